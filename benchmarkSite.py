@@ -0,0 +1,268 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import argparse
+import collections
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import exifread
+import PIL
+from PIL import Image
+
+import prepareSite
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage, peak RSS is reported as null
+    resource = None
+
+STAGES = ['scan', 'thumbnail', 'metadata', 'lqip', 'pipeline']
+
+def peakRSS():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024  # Linux reports KiB, macOS bytes
+
+# --- Stages, each timed on its own inside the worker ---
+
+def stage_scan(name, options):
+    prepareSite.scan_sort_key(name)
+
+def stage_thumbnail(name, options):
+    with open(f'{prepareSite.fullDir}/{name}.jpg', 'rb') as f:
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as img_pil:
+        base = prepareSite.backend(options, 'decode')(img_pil, data, [options['size']], options)
+    thumb = prepareSite.backend(options, 'resize')(base, options['size'], options['filter'])
+    prepareSite.backend(options, 'encode')(thumb, options['quality'], options['optimize'], options['progressive'])
+
+def stage_metadata(name, options):
+    with open(f'{prepareSite.fullDir}/{name}.jpg', 'rb') as f:
+        tags = exifread.process_file(f, details=options['fields'] is None)
+    prepareSite.extract_metadata(tags, options['fields'])
+
+def stage_lqip(name, options):
+    with Image.open(f'{prepareSite.thumbDir}/{name}.jpg') as thumb:
+        thumb.load()
+        prepareSite.make_blurhash(thumb)
+
+def stage_pipeline(name, options):
+    # process_image reports a failure in the record instead of raising it
+    meta = prepareSite.process_image((name, options))[2]
+    if 'Error' in meta:
+        raise ValueError(meta['Error'])
+
+def run_stage(args):
+    stage, name, options = args
+    t0 = time.perf_counter()
+    try:
+        globals()[f'stage_{stage}'](name, options)
+        failed = False
+    except Exception:  # Damaged files in the corpus (--corrupt) are counted, not fatal
+        failed = True
+    return (time.perf_counter() - t0, os.getpid(), peakRSS(), failed)
+
+def evictCorpus(names):
+    # Drop the corpus from the OS page cache so the next run reads from storage (Linux only)
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    for name in names:
+        for path in [f'{prepareSite.fullDir}/{name}.jpg', f'{prepareSite.thumbDir}/{name}.jpg']:
+            if os.path.exists(path):
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)  # Dirty pages can't be dropped
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                finally:
+                    os.close(fd)
+    return True
+
+def measure(stage, names, options, jobs, prefetch=0, cold=False):
+    if cold:
+        evictCorpus(names)
+    cpu0 = os.times()
+    t0 = time.perf_counter()
+    # A fresh pool per measurement so peak RSS is this stage's alone. Tasks are handed out a few at
+    # a time (like prepareSite.processImages), so the prefetcher stays just ahead of the workers.
+    samples = []
+    with Pool(jobs) as pool:
+        pending = collections.deque()
+        for name in prepareSite.prefetchAhead(names, prefetch):
+            if len(pending) >= 2 * jobs:
+                samples.append(pending.popleft().get())
+            pending.append(pool.apply_async(run_stage, ((stage, name, options),)))
+        samples += [result.get() for result in pending]
+    wall = time.perf_counter() - t0
+    cpu1 = os.times()
+
+    latencies = np.array([latency for latency, _, _, _ in samples]) * 1000
+    workers = {}
+    for _, pid, rss, _ in samples:
+        if rss is not None:
+            workers[pid] = max(workers.get(pid, 0), rss)
+    cpu = (cpu1.children_user - cpu0.children_user) + (cpu1.children_system - cpu0.children_system)
+    return {
+        'stage': stage,
+        'jobs': jobs,
+        'prefetch': prefetch,
+        'cold': cold,
+        'images': len(names),
+        'errors': sum(failed for _, _, _, failed in samples),
+        'wall_s': round(wall, 4),
+        'images_per_s': round(len(names) / wall, 3),
+        'latency_ms': {
+            'mean': round(float(latencies.mean()), 3),
+            'p50': round(float(np.percentile(latencies, 50)), 3),
+            'p99': round(float(np.percentile(latencies, 99)), 3),
+            'max': round(float(latencies.max()), 3),
+        },
+        'cpu_utilization': round(cpu / (wall * jobs), 3),
+        'peak_rss_mb': round(max(workers.values()) / 2**20, 1) if workers else None,
+        'worker_rss_mb': sorted(round(rss / 2**20, 1) for rss in workers.values()),
+    }
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment():
+    return {
+        'commit': gitCommit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': cpu_count(),
+        'pillow': PIL.__version__,
+        'exifread': getattr(exifread, '__version__', None),
+        'numpy': np.__version__,
+        'opencv': prepareSite.cv.__version__,
+    }
+
+def printTable(results):
+    print(f"\n{'stage':<10} {'jobs':>4} {'ahead':>5} {'img/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'cpu':>6} {'rss MB':>8} {'scaling':>8} {'errors':>6}")
+    for r in results:
+        scaling = f"{r['scaling']:.2f}" if r.get('scaling') is not None else '-'
+        rss = f"{r['peak_rss_mb']:.1f}" if r['peak_rss_mb'] is not None else '-'
+        print(f"{r['stage']:<10} {r['jobs']:>4} {r['prefetch']:>5} {r['images_per_s']:>9.2f} {r['latency_ms']['p50']:>9.1f} "
+              f"{r['latency_ms']['p99']:>9.1f} {r['cpu_utilization']:>6.0%} {rss:>8} {scaling:>8} {r['errors']:>6}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the prepareSite.py pipeline on a generated corpus.')
+    parser.add_argument('-n', '--number', type=int, default=50, help='Number of images in the corpus (default: 50).')
+    parser.add_argument('--size', type=lambda v: [tuple(int(x) for x in s.lower().split('x')) for s in v.split(',')], default=[(4000, 3000)], help='Comma separated corpus resolutions as WxH, picked at random per image (default: 4000x3000).')
+    parser.add_argument('--content', choices=['color', 'gray'], default='color', help='Photo-like colour images, or the plain numbered frames of the first-run samples (default: color).')
+    parser.add_argument('--no-exif', action='store_true', help='Generate the corpus without EXIF (camera, exposure, date, orientation, GPS).')
+    parser.add_argument('--rotated', type=float, default=0.1, help='Fraction of images with a rotating EXIF orientation (default: 0.1).')
+    parser.add_argument('--date-spread', type=int, default=730, help='Days over which DateTimeOriginal is spread (default: 730).')
+    parser.add_argument('--gps', type=float, default=0.5, help='Fraction of geotagged images (default: 0.5).')
+    parser.add_argument('--corrupt', type=float, default=0.0, help='Fraction of truncated or damaged files (default: 0).')
+    parser.add_argument('--huge', type=float, default=0.0, help='Fraction of --huge-size panoramas (default: 0).')
+    parser.add_argument('--huge-size', type=lambda v: tuple(int(x) for x in v.lower().split('x')), default=(12000, 8000), help='Resolution of the huge images as WxH (default: 12000x8000).')
+    parser.add_argument('--seed', type=int, default=0, help='Corpus random seed; the same seed and settings give the same files (default: 0).')
+    parser.add_argument('--generate-only', action='store_true', help='Only generate the corpus in --workdir (e.g. to load-test a full prepareSite.py build there) and exit.')
+    parser.add_argument('-j', '--jobs', type=lambda v: [int(j) for j in v.split(',')], default=sorted({1, cpu_count()}), help='Comma separated worker counts to measure (default: 1 and all cores).')
+    parser.add_argument('--stages', type=lambda v: v.split(','), default=STAGES, help=f"Comma separated stages (default: {','.join(STAGES)}).")
+    parser.add_argument('--prefetch', type=lambda v: [int(p) for p in v.split(',')], default=[0], help='Comma separated read-ahead depths to measure, e.g. 0,8 (default: 0).')
+    parser.add_argument('--cold', action='store_true', help='Evict the corpus from the page cache before every run, to measure reads from storage (Linux).')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per stage and worker count; the fastest is kept (default: 1).')
+    parser.add_argument('--workdir', type=str, default=None, help='Where to generate the corpus (default: a temporary directory). An existing corpus there is reused.')
+    parser.add_argument('--build-args', type=str, default='', help='Extra prepareSite.py options for the stages, e.g. "--draft off".')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Write the results as JSON to this file.')
+    args = parser.parse_args()
+
+    unknown = [stage for stage in args.stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"Unknown stage(s): {', '.join(unknown)}")
+    if args.generate_only and not args.workdir:
+        parser.error('--generate-only needs --workdir')
+
+    buildParser = prepareSite.buildParser()
+    buildArgs = buildParser.parse_args(args.build_args.split())
+    options = prepareSite.buildOptions(buildArgs, buildParser)
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='gallery-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # prepareSite works relative to the current directory
+
+    # Corpus, regenerated when it is too small or was made with other settings. Only a corpus this
+    # tool wrote (it has corpus.json) or an empty fulls/ is ever touched, never a real gallery.
+    corpus = {'sizes': [list(s) for s in args.size], 'quality': options['quality'], 'content': args.content, 'exif': not args.no_exif,
+              'seed': args.seed, 'rotated': args.rotated, 'date_spread': args.date_spread, 'gps': args.gps,
+              'corrupt': args.corrupt, 'huge': args.huge, 'huge_size': list(args.huge_size)}
+    corpusJSON = os.path.join(prepareSite.fullDir, 'corpus.json')
+    for d in [prepareSite.fullDir, prepareSite.thumbDir]:
+        if not os.path.exists(d): os.mkdir(d)
+    names = sorted(os.path.splitext(f)[0] for f in os.listdir(prepareSite.fullDir) if f.endswith('.jpg'))
+    previous = None
+    if os.path.exists(corpusJSON):
+        with open(corpusJSON) as f:
+            previous = json.load(f)
+    if len(names) < args.number or previous != corpus:
+        if not isinstance(previous, dict) or set(previous) != set(corpus):
+            if os.listdir(prepareSite.fullDir):
+                sys.exit(f'{os.path.normpath(os.path.join(workdir, prepareSite.fullDir))} holds images that this tool did not generate. '
+                         'Point --workdir at an empty directory or a previous benchmark corpus.')
+        else:
+            for file in os.listdir(prepareSite.fullDir):
+                if file == 'corpus.json' or (file.endswith('.jpg') and file[:-4].isdigit()):
+                    os.remove(os.path.join(prepareSite.fullDir, file))
+        prepareSite.configurePool(max(args.jobs))
+        prepareSite.createSampleImages(N=args.number, quality=options['quality'], sizes=args.size, content=args.content,
+                                       exif=not args.no_exif, seed=args.seed, rotated=args.rotated, dateSpread=args.date_spread,
+                                       gps=args.gps, corrupt=args.corrupt, huge=args.huge, hugeSize=args.huge_size)
+        prepareSite.closePool()
+        prepareSite.writeJSON(corpusJSON, corpus, indent=4)
+        names = sorted(os.path.splitext(f)[0] for f in os.listdir(prepareSite.fullDir) if f.endswith('.jpg'))
+    names = sorted(names, key=lambda name: int(name) if name.isdigit() else name)[:args.number]
+    if args.generate_only:
+        print(f'Generated {len(names)} images in {os.path.normpath(os.path.join(workdir, prepareSite.fullDir))}')
+        sys.exit()
+    if buildArgs.engine == 'auto':
+        options['engine'] = prepareSite.chooseEngine(names, options, buildArgs.min_psnr)
+    if 'lqip' in args.stages:
+        # The LQIP stage works from thumbnails, so make sure they exist
+        with Pool(max(args.jobs)) as pool:
+            pool.map(prepareSite.process_image, [(name, options) for name in names])
+
+    if args.cold and not hasattr(os, 'posix_fadvise'):
+        print('Warning: --cold needs posix_fadvise (Linux), runs will be warm.')
+
+    results = []
+    for stage in [s for s in STAGES if s in args.stages]:
+        for prefetch in args.prefetch:
+            baseline = None
+            for jobs in args.jobs:
+                result = min((measure(stage, names, options, jobs, prefetch, args.cold) for _ in range(max(1, args.repeat))), key=lambda r: r['wall_s'])
+                if baseline is None:
+                    baseline = result['images_per_s'] / jobs
+                result['scaling'] = round(result['images_per_s'] / (baseline * jobs), 3)  # 1.0 = perfectly linear
+                results.append(result)
+                print(f"{stage} x{jobs} (prefetch {prefetch}): {result['images_per_s']:.2f} img/s, {result['cpu_utilization']:.0%} CPU")
+
+    printTable(results)
+    report = {
+        'environment': environment(),
+        'corpus': dict(corpus, images=len(names), workdir=workdir),
+        'options': {k: list(v) if isinstance(v, tuple) else v for k, v in options.items()},
+        'results': results,
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f'\nWrote {output}')
+    if not args.workdir:
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(workdir, ignore_errors=True)
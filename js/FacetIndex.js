@@ -0,0 +1,109 @@
+/**
+ * FacetIndex - Filters over metadata/facets.json without scanning the records
+ *
+ * Every query returns ascending image ordinals (positions in index.json's order):
+ * - match(): posting list of one text value (camera, lens, ...)
+ * - range(): numbers or dates between two bounds, via binary search over the sorted values
+ * - intersect() / union(): combine the results of several filters
+ */
+export class FacetIndex {
+    constructor(data) {
+        this.values = data.values || {};
+        this.ranges = data.ranges || {};
+    }
+
+    /**
+     * Load the index, or resolve to null for builds without one
+     * @param {string} url
+     * @returns {Promise<FacetIndex|null>}
+     */
+    static async load(url = './metadata/facets.json') {
+        const response = await fetch(url).catch(() => null);
+        return response && response.ok ? new FacetIndex(await response.json()) : null;
+    }
+
+    /**
+     * Distinct values of a text field with their image counts, most common first
+     * @param {string} field - e.g. 'Image Model'
+     * @returns {Array<[string, number]>}
+     */
+    options(field) {
+        return Object.entries(this.values[field] || {})
+            .map(([value, images]) => [value, images.length])
+            .sort((a, b) => b[1] - a[1]);
+    }
+
+    /**
+     * Images whose text field equals value
+     * @returns {number[]}
+     */
+    match(field, value) {
+        return (this.values[field] && this.values[field][value]) || [];
+    }
+
+    /**
+     * Images whose numeric or date field lies in [min, max]; dates may be given as Date or ISO strings
+     * @returns {number[]}
+     */
+    range(field, min = -Infinity, max = Infinity) {
+        const facet = this.ranges[field];
+        if (!facet) return [];
+        const start = FacetIndex.lowerBound(facet.values, FacetIndex.toNumber(min));
+        const end = FacetIndex.upperBound(facet.values, FacetIndex.toNumber(max));
+        return facet.images.slice(start, end).sort((a, b) => a - b);
+    }
+
+    // Dates are indexed as seconds of their (camera-local) timestamp, read as UTC
+    static toNumber(value) {
+        if (value instanceof Date) return Math.floor(value.getTime() / 1000);
+        if (typeof value === 'string') return Math.floor(Date.parse(value.endsWith('Z') ? value : `${value}Z`) / 1000);
+        return value;
+    }
+
+    static lowerBound(values, target) {
+        let lo = 0, hi = values.length;
+        while (lo < hi) {
+            const mid = (lo + hi) >> 1;
+            if (values[mid] < target) lo = mid + 1; else hi = mid;
+        }
+        return lo;
+    }
+
+    static upperBound(values, target) {
+        let lo = 0, hi = values.length;
+        while (lo < hi) {
+            const mid = (lo + hi) >> 1;
+            if (values[mid] <= target) lo = mid + 1; else hi = mid;
+        }
+        return lo;
+    }
+
+    /**
+     * Images present in every list (each ascending), smallest list first
+     * @returns {number[]}
+     */
+    static intersect(...lists) {
+        if (lists.length === 0) return [];
+        lists = [...lists].sort((a, b) => a.length - b.length);
+        let result = lists[0];
+        for (const list of lists.slice(1)) {
+            const next = [];
+            let j = 0;
+            for (const id of result) {
+                while (j < list.length && list[j] < id) j++;
+                if (j === list.length) break;
+                if (list[j] === id) next.push(id);
+            }
+            result = next;
+        }
+        return result;
+    }
+
+    /**
+     * Images present in any of the lists, e.g. several selected cameras
+     * @returns {number[]}
+     */
+    static union(...lists) {
+        return [...new Set(lists.flat())].sort((a, b) => a - b);
+    }
+}
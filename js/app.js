@@ -4,6 +4,7 @@ import { View2D } from './view2d.js';
 import { SettingsManager } from './settings.js';
 import { ViewStateManager } from './ViewStateManager.js';
 import { TouchManager } from './TouchManager.js';
+import { FacetIndex } from './FacetIndex.js';
 
 class App {
     constructor() {
@@ -11,6 +12,7 @@ class App {
         this.currentIndex = 0;
         this.images = [];
         this.metadata = {};
+        this.visible = null; // Ascending indices matching the active filter (null: no filter)
         this.isMobile = /Android|webOS|iPhone|iPad|iPod|BlackBerry|IEMobile|Opera Mini/i.test(navigator.userAgent) || (navigator.maxTouchPoints > 1);
 
         // Debug Flag
@@ -251,21 +253,14 @@ class App {
 
     async loadData() {
         try {
-            // 1. Try Loading Metadata
-            const response = await fetch('./metadata/metadata.json');
-            if (!response.ok) throw new Error("Metadata check failed");
-            const data = await response.json();
-
-            // 2. Parse Data
-            this.metadata = data;
-            // image_order contains filenames without extension/path based on viewing file
-            // Actually the file says "image_order": ["0", "1", ...]
-            // And keys are "0", "1".
-            // So we can use image_order directly.
-            this.images = data.image_order || Object.keys(data).filter(k => k !== 'image_order');
+            // 1 & 2. Load the compact index (full details are fetched per page on demand)
+            await this.loadIndex();
 
             this.log(`Loaded metadata with ${this.images.length} images.`);
 
+            // Find out which responsive formats this browser can decode
+            await this.detectVariantFormats();
+
             // 3. Preload Thumbnails (Blocking)
             await this.preloadAllThumbnails();
 
@@ -276,7 +271,8 @@ class App {
                 (index) => this.preloadHighRes(index),
                 this.isMobile,
                 this.isDebug,
-                () => { if (!this.isSlideshowActive) this.toggleMagnifier(); } // Auto-Magnify Callback
+                () => { if (!this.isSlideshowActive) this.toggleMagnifier(); }, // Auto-Magnify Callback
+                this.atlas
             );
 
             // 5. Init 2D View
@@ -397,8 +393,12 @@ class App {
     }
 
     preloadAllThumbnails() {
+        // With an atlas the sphere only needs its few sheets, not one thumb per photo
+        const urls = this.atlas
+            ? this.atlas.sheets.map((version, i) => `./atlas/${i}.jpg?v=${version}`)
+            : this.images.map(imgName => `./thumbs/${imgName}.jpg`);
         return new Promise((resolve) => {
-            const total = this.images.length;
+            const total = urls.length;
             const text = document.getElementById('loading-text');
             const bar = document.getElementById('loading-bar');
 
@@ -424,7 +424,7 @@ class App {
                 if (bar) bar.style.width = `${percent}%`;
 
                 // Update File Name
-                if (fileName && elFile) elFile.innerText = `Downloading: ${fileName}.jpg`;
+                if (fileName && elFile) elFile.innerText = `Downloading: ${fileName.split('/').pop().split('?')[0]}`;
 
                 // Update Data & Speed
                 if (elData) elData.innerText = `${(totalBytes / (1024 * 1024)).toFixed(2)} MB`;
@@ -440,12 +440,12 @@ class App {
                 }
             };
 
-            const loadNext = async (imgName) => {
+            const loadNext = async (url) => {
                 try {
                     activeDownloads++;
-                    updateStats(imgName);
+                    updateStats(url);
 
-                    const response = await fetch(`./thumbs/${imgName}.jpg`);
+                    const response = await fetch(url);
                     if (!response.ok) throw new Error('Network response was not ok');
 
                     const reader = response.body.getReader();
@@ -462,7 +462,7 @@ class App {
                     // Success
                     loadedCount++;
                 } catch (err) {
-                    if (this.isDebug) console.warn("Failed to load thumb:", imgName, err);
+                    if (this.isDebug) console.warn("Failed to load thumb:", url, err);
                     loadedCount++; // Count as done to proceed
                 } finally {
                     activeDownloads--;
@@ -478,14 +478,202 @@ class App {
             // Launch all (Browser limits concurrency automatically, usually 6)
             // Or we could batch? Simple loop is mostly fine for <50 items.
             // But for safety let's just loop.
-            this.images.forEach(img => loadNext(img));
+            urls.forEach(url => loadNext(url));
+        });
+    }
+
+    async loadIndex() {
+        this.tileSize = 254; // Deep Zoom defaults, for builds that predate them in the index
+        this.tileOverlap = 1;
+        const response = await fetch('./metadata/index.json');
+        if (!response.ok) {
+            // Older builds only have the monolithic metadata.json
+            const legacy = await fetch('./metadata/metadata.json');
+            if (!legacy.ok) throw new Error("Metadata check failed");
+            const data = await legacy.json();
+            this.metadata = data;
+            this.images = data.image_order || Object.keys(data).filter(k => k !== 'image_order');
+            this.pageSize = 0;
+            return;
+        }
+        const index = await response.json();
+
+        // Seed each record with what the grid and sphere need up front
+        this.images = index.order;
+        this.pageSize = index.page_size;
+        if (index.tile_size) {
+            this.tileSize = index.tile_size;
+            this.tileOverlap = index.tile_overlap;
+        }
+        this.metadataPages = new Map();
+        this.metadata = {};
+        this.images.forEach((name, i) => {
+            const m = {};
+            const dims = index.dims[i];
+            if (dims) [m['Image Width'], m['Image Height']] = dims;
+            if (index.blurhash && index.blurhash[i]) m.blurhash = index.blurhash[i];
+            else if (index.lqip && index.lqip[i]) m.lqip = index.lqip[i];
+            const widths = index.widths && index.widths[i];
+            if (widths) m.variants = Object.fromEntries(index.formats.map(f => [f, widths]));
+            if (index.tiles && index.tiles[i]) m.tiles = index.tiles[i];
+            this.metadata[name] = m;
+        });
+
+        // Optional thumbnail atlas for the 3D view
+        const atlas = await fetch('./metadata/atlas.json').catch(() => null);
+        this.atlas = atlas && atlas.ok ? await atlas.json() : null;
+    }
+
+    // Fetch (once) the facet index, for filtering by camera, lens, date, ISO, ... by lookup
+    loadFacets() {
+        if (!this.facetsRequest) this.facetsRequest = FacetIndex.load();
+        return this.facetsRequest;
+    }
+
+    // Indices (ascending) of the images matching every filter, e.g. {'Image Model': ['X-T4'], 'EXIF ISOSpeedRatings': [100, 800]}:
+    // arrays of strings select text values, [min, max] pairs select numeric or date ranges. Null without a facet index.
+    async filterIndices(filters) {
+        const facets = await this.loadFacets();
+        if (!facets) return null;
+        const lists = Object.entries(filters).map(([field, selection]) => (field in facets.ranges)
+            ? facets.range(field, selection[0], selection[1])
+            : FacetIndex.union(...selection.map(value => facets.match(field, value))));
+        return FacetIndex.intersect(...lists);
+    }
+
+    // Same as filterIndices, as image names
+    async filterImages(filters) {
+        const indices = await this.filterIndices(filters);
+        return indices ? indices.map(i => this.images[i]) : this.images;
+    }
+
+    // Fill the filter controls from the facet index, the first time the settings are opened
+    async setupFilters() {
+        if (this.filtersReady) return;
+        this.filtersReady = true;
+        const facets = await this.loadFacets();
+        const group = document.getElementById('group-filter');
+        if (!facets || !group) return;
+
+        const fill = (id, field) => {
+            const select = document.getElementById(id);
+            const options = facets.options(field);
+            select.closest('label').hidden = options.length === 0;
+            options.forEach(([value, count]) => select.add(new Option(`${value} (${count})`, value)));
+            select.onchange = () => this.applyFilters();
+        };
+        fill('filter-camera', 'Image Model');
+        fill('filter-lens', 'EXIF LensModel');
+        const hasDates = 'EXIF DateTimeOriginal' in facets.ranges;
+        ['filter-from', 'filter-to'].forEach(id => {
+            const input = document.getElementById(id);
+            input.closest('label').hidden = !hasDates;
+            input.onchange = () => this.applyFilters();
+        });
+        document.getElementById('clearFilter').onclick = () => {
+            ['filter-camera', 'filter-lens', 'filter-from', 'filter-to'].forEach(id => document.getElementById(id).value = '');
+            this.applyFilters();
+        };
+        document.getElementById('filter-count').textContent = this.images.length;
+        group.classList.remove('hidden');
+    }
+
+    // Show only the images matching the filter controls; indices stay those of the full gallery
+    async applyFilters() {
+        const value = id => document.getElementById(id).value;
+        const filters = {};
+        if (value('filter-camera')) filters['Image Model'] = [value('filter-camera')];
+        if (value('filter-lens')) filters['EXIF LensModel'] = [value('filter-lens')];
+        if (value('filter-from') || value('filter-to')) {
+            filters['EXIF DateTimeOriginal'] = [
+                value('filter-from') ? `${value('filter-from')}T00:00:00` : -Infinity,
+                value('filter-to') ? `${value('filter-to')}T23:59:59` : Infinity
+            ];
+        }
+        this.visible = Object.keys(filters).length ? await this.filterIndices(filters) : null;
+
+        const shown = this.visible ? new Set(this.visible) : null;
+        this.view2d.setVisible(shown);
+        this.view3d.setVisible(shown);
+        document.querySelectorAll('#thumbnail-selector .thumb-small').forEach((thumb, i) => {
+            thumb.hidden = !this.isVisible(i);
         });
+        document.getElementById('filter-count').textContent = this.visible ? this.visible.length : this.images.length;
+        if (shown && shown.size && !shown.has(this.currentIndex)) this.selectImage(this.visible[0]);
+    }
+
+    // Whether an image passes the active filter
+    isVisible(index) {
+        return !this.visible || this.visible[FacetIndex.lowerBound(this.visible, index)] === index;
+    }
+
+    // The next image in `step` direction that passes the filter, wrapping around the gallery
+    stepIndex(step) {
+        const count = this.images.length;
+        if (!this.visible) return ((this.currentIndex + step) % count + count) % count;
+        if (this.visible.length === 0) return this.currentIndex;
+        const at = FacetIndex.lowerBound(this.visible, this.currentIndex);
+        if (step > 0) return this.visible[this.visible[at] === this.currentIndex ? (at + 1) % this.visible.length : at % this.visible.length];
+        return this.visible[(at - 1 + this.visible.length) % this.visible.length];
+    }
+
+    // Fetch (once) the detail shard holding this image's full record
+    loadMetadataPage(index) {
+        if (!this.pageSize) return Promise.resolve();
+        const page = Math.floor(index / this.pageSize);
+        if (!this.metadataPages.has(page)) {
+            const request = fetch(`./metadata/shards/${page}.json`)
+                .then(response => {
+                    if (!response.ok) throw new Error(`Shard ${page} failed`);
+                    return response.json();
+                })
+                .then(shard => {
+                    Object.entries(shard).forEach(([name, m]) => Object.assign(this.metadata[name] || (this.metadata[name] = {}), m));
+                })
+                .catch(err => {
+                    this.metadataPages.delete(page); // Allow a retry on the next selection
+                    if (this.isDebug) console.warn("Failed to load metadata shard:", page, err);
+                });
+            this.metadataPages.set(page, request);
+        }
+        return this.metadataPages.get(page);
+    }
+
+    async detectVariantFormats() {
+        // Probe with the smallest real variant of the first image that has them
+        this.variantFormats = ['jpg'];
+        const name = this.images.find(n => this.metadata[n] && this.metadata[n].variants);
+        if (!name) return;
+        const variants = this.metadata[name].variants;
+        const probe = (ext) => new Promise((resolve) => {
+            const img = new Image();
+            img.onload = () => resolve(img.naturalWidth > 0);
+            img.onerror = () => resolve(false);
+            img.src = `./sizes/${name}-${variants[ext][0]}.${ext}`;
+        });
+        const candidates = Object.keys(variants).filter(ext => ext !== 'jpg' && variants[ext].length);
+        const supported = await Promise.all(candidates.map(probe));
+        this.variantFormats = candidates.filter((ext, i) => supported[i]).concat('jpg');
+        this.log(`Variant formats: ${this.variantFormats.join(', ')}`);
+    }
+
+    // Smallest generated variant that covers the screen, falling back to the full (or thumb in datasaver)
+    imageSrc(imgName) {
+        const fallback = `./${this.useDataSaver ? 'thumbs' : 'fulls'}/${imgName}.jpg`;
+        const m = this.metadata[imgName];
+        const variants = m && m.variants;
+        const ext = variants && (this.variantFormats || ['jpg']).find(f => variants[f] && variants[f].length);
+        if (!ext) return fallback;
+        const widths = variants[ext];
+        const dpr = this.useDataSaver ? 1 : (window.devicePixelRatio || 1);
+        const width = widths.find(w => w >= window.screen.width * dpr);
+        if (!width && !this.useDataSaver) return fallback;
+        return `./sizes/${imgName}-${width || widths[widths.length - 1]}.${ext}`;
     }
 
     preloadFullImages() {
         this.log("Starting background preload of full images...");
-        const dir = this.useDataSaver ? 'thumbs' : 'fulls';
-        if (dir === 'thumbs') return;
+        if (this.useDataSaver) return;
 
         // Low priority loading
         let loadedCount = 0;
@@ -493,7 +681,7 @@ class App {
             // Stagger requests to avoid freezing UI
             setTimeout(() => {
                 const img = new Image();
-                img.src = `./fulls/${imgName}.jpg`;
+                img.src = this.imageSrc(imgName);
                 img.onload = () => {
                     loadedCount++;
                     if (loadedCount === this.images.length) this.log("All full images preloaded.");
@@ -675,6 +863,7 @@ class App {
             openSettings.onclick = () => {
                 settingsModal.classList.remove('hidden');
                 setTimeout(() => settingsModal.classList.add('visible'), 10);
+                this.setupFilters();
 
                 // Toggle Groups based on Mode
                 const group3d = document.getElementById('group-3d');
@@ -822,25 +1011,22 @@ class App {
 
         // Update image counter
         if (this.ui.imageCounter) {
-            this.ui.imageCounter.textContent = `${index + 1} / ${this.images.length}`;
-        }
-
-        // Update inline EXIF strip
-        if (this.ui.viewerExifStrip) {
-            const imgName = this.images[index];
-            const m = this.metadata[imgName];
-            const fields = [
-                m && m['Image Model'],
-                m && m['EXIF FocalLength'] && `${m['EXIF FocalLength']}mm`,
-                m && m['EXIF FNumber'] && `f/${m['EXIF FNumber']}`,
-                m && m['EXIF ISOSpeedRatings'] && `ISO ${m['EXIF ISOSpeedRatings']}`,
-            ].filter(Boolean);
-            this.ui.viewerExifStrip.innerHTML = fields.map(f => `<span>${f}</span>`).join('');
+            this.ui.imageCounter.textContent = this.visible
+                ? `${FacetIndex.lowerBound(this.visible, index) + 1} / ${this.visible.length}`
+                : `${index + 1} / ${this.images.length}`;
         }
 
-        // Update Metadata
+        // Update inline EXIF strip & Metadata
+        this.updateExifStrip(index);
         this.updateMetadata(index);
 
+        // Details live in per-page shards; refresh once this image's page has arrived
+        this.loadMetadataPage(index).then(() => {
+            if (this.currentIndex !== index) return;
+            this.updateExifStrip(index);
+            this.updateMetadata(index);
+        });
+
         // Check visibility
         const isViewerVisible = !this.ui.imageViewer.hidden;
         this.log(`selectImage: ViewerVisible? ${isViewerVisible} ReqOpen? ${openViewer}`);
@@ -868,8 +1054,7 @@ class App {
     preloadHighRes(index) {
         if (!this.images[index]) return;
         const imgName = this.images[index];
-        const dir = this.useDataSaver ? 'thumbs' : 'fulls';
-        const src = `./${dir}/${imgName}.jpg`;
+        const src = this.imageSrc(imgName);
         // Create link
         const link = document.createElement('link');
         link.rel = 'preload';
@@ -881,15 +1066,11 @@ class App {
     }
 
     next(openViewer = false) {
-        let nextIndex = this.currentIndex + 1;
-        if (nextIndex >= this.images.length) nextIndex = 0; // Loop to start
-        this.selectImage(nextIndex, openViewer, 1);
+        this.selectImage(this.stepIndex(1), openViewer, 1); // Loops to start, skipping filtered-out images
     }
 
     prev() {
-        let prevIndex = this.currentIndex - 1;
-        if (prevIndex < 0) prevIndex = this.images.length - 1; // Loop to end
-        this.selectImage(prevIndex, false, -1);
+        this.selectImage(this.stepIndex(-1), false, -1); // Loops to end
     }
 
     typeTitle() {
@@ -1013,6 +1194,19 @@ class App {
     }
 
     // --- Metadata Logic ---
+    updateExifStrip(index) {
+        if (!this.ui.viewerExifStrip) return;
+        const imgName = this.images[index];
+        const m = this.metadata[imgName];
+        const fields = [
+            m && m['Image Model'],
+            m && m['EXIF FocalLength'] && `${m['EXIF FocalLength']}mm`,
+            m && m['EXIF FNumber'] && `f/${m['EXIF FNumber']}`,
+            m && m['EXIF ISOSpeedRatings'] && `ISO ${m['EXIF ISOSpeedRatings']}`,
+        ].filter(Boolean);
+        this.ui.viewerExifStrip.innerHTML = fields.map(f => `<span>${f}</span>`).join('');
+    }
+
     updateMetadata(index) {
         if (!this.images[index]) return;
         const imgName = this.images[index];
@@ -1024,6 +1218,7 @@ class App {
             // Formatting helpers
             const exifToDate = (ts) => {
                 if (!ts) return 'N/A';
+                if (ts.includes('T')) return new Date(ts); // ISO timestamp
                 const [d, t] = ts.split(' ');
                 return new Date(d.replace(/:/g, '/') + ' ' + t);
             };
@@ -1049,6 +1244,9 @@ class App {
             };
 
             const getGPS = (d) => {
+                if (typeof d['GPS Latitude'] === 'number' && typeof d['GPS Longitude'] === 'number') {
+                    return { lat: d['GPS Latitude'].toFixed(4), lon: d['GPS Longitude'].toFixed(4) };
+                }
                 const lat = d['GPS GPSLatitude'], latRef = d['GPS GPSLatitudeRef'];
                 const lon = d['GPS GPSLongitude'], lonRef = d['GPS GPSLongitudeRef'];
                 if (lat && latRef && lon && lonRef) {
@@ -1129,16 +1327,17 @@ class App {
 
         // Construct URL
         const imgName = this.images[index];
-        const dir = this.useDataSaver ? 'thumbs' : 'fulls';
+        // The immersive viewer is for zooming in, so it keeps the originals unless saving data
+        const pathFor = (name) => this.useDataSaver ? this.imageSrc(name) : `./fulls/${name}.jpg`;
 
         let nextIdx = index + 1;
         if (nextIdx >= this.images.length) nextIdx = 0;
         let prevIdx = index - 1;
         if (prevIdx < 0) prevIdx = this.images.length - 1;
 
-        const mainPath = `./${dir}/${imgName}.jpg`;
-        const nextPath = `./${dir}/${this.images[nextIdx]}.jpg`;
-        const prevPath = `./${dir}/${this.images[prevIdx]}.jpg`;
+        const mainPath = pathFor(imgName);
+        const nextPath = pathFor(this.images[nextIdx]);
+        const prevPath = pathFor(this.images[prevIdx]);
 
         let url = `immersive.html?img=${encodeURIComponent(mainPath)}`;
         url += `&next=${encodeURIComponent(nextPath)}`;
@@ -1328,6 +1527,7 @@ class App {
 
         const oldImg = container.querySelector('img.active');
         const oldOverlay = container.querySelector('.input-overlay');
+        container.querySelectorAll('.tile-layer').forEach(layer => layer.remove());
 
         if (oldOverlay) oldOverlay.remove();
 
@@ -1374,6 +1574,9 @@ class App {
             newImg.style.transform = 'translate(0, 0) scale(1)';
         }
 
+        // Full resolution tiles, shown over the image once zoomed in
+        const tileLayer = this.createTileLayer(imgName, newImg);
+
         // --- 3. SETUP INPUT OVERLAY ---
         const overlay = document.createElement('div');
         overlay.className = 'input-overlay';
@@ -1417,6 +1620,7 @@ class App {
             pannedY = clamp(pannedY, -maxY, maxY);
 
             newImg.style.transform = `translate(${pannedX}px, ${pannedY}px) scale(${zoomLevel})`;
+            if (tileLayer) tileLayer.update(zoomLevel, newImg.style.transform, newImg.style.transition);
 
             if (zoomLevel > 1) {
                 overlay.style.cursor = isDragging ? 'grabbing' : 'grab';
@@ -1606,11 +1810,112 @@ class App {
 
         // --- 8. MOUNT & SET SRC ---
         container.appendChild(newImg);
+        if (tileLayer) container.appendChild(tileLayer.element);
         container.appendChild(overlay);
 
-        // Datasaver Logic
-        const dir = this.useDataSaver ? 'thumbs' : 'fulls';
-        newImg.src = `./${dir}/${imgName}.jpg`;
+        // Responsive variant (or datasaver thumb / full)
+        newImg.src = this.imageSrc(imgName);
+    }
+
+    // Deep Zoom tiles for a zoomed-in image: only the tiles in view, at the pyramid level matching
+    // the on-screen size, are fetched. The screen-sized image underneath shows until they arrive.
+    createTileLayer(imgName, baseImg) {
+        const m = this.metadata[imgName];
+        if (!m || !m.tiles || this.useDataSaver) return null;
+        const [width, height] = m.tiles;
+        const tileSize = this.tileSize;
+        const overlap = this.tileOverlap;
+        const maxLevel = Math.ceil(Math.log2(Math.max(width, height)));
+
+        const layer = document.createElement('div');
+        layer.className = 'tile-layer';
+        Object.assign(layer.style, {
+            position: 'absolute',
+            zIndex: '11',
+            overflow: 'hidden',
+            pointerEvents: 'none',
+            transformOrigin: 'center center',
+            display: 'none'
+        });
+
+        const tiles = new Map();
+        let level = -1;
+        let frame = 0;
+
+        const render = () => {
+            // Cover the image's layout box; the zoom/pan transform is copied over in update()
+            Object.assign(layer.style, {
+                left: `${baseImg.offsetLeft}px`,
+                top: `${baseImg.offsetTop}px`,
+                width: `${baseImg.offsetWidth}px`,
+                height: `${baseImg.offsetHeight}px`
+            });
+            const rect = layer.getBoundingClientRect();
+            const view = layer.parentElement ? layer.parentElement.getBoundingClientRect() : null;
+            if (!view || !rect.width || !rect.height) return;
+
+            // Lowest level that is at least as sharp as the screen
+            const dpr = window.devicePixelRatio || 1;
+            const wanted = Math.max(0, Math.min(maxLevel, maxLevel - Math.floor(Math.log2(width / (rect.width * dpr)))));
+            if (wanted !== level) {
+                tiles.forEach(tile => tile.remove());
+                tiles.clear();
+                level = wanted;
+            }
+            const scale = Math.pow(2, maxLevel - level);
+            const levelW = Math.ceil(width / scale);
+            const levelH = Math.ceil(height / scale);
+
+            // Visible part of the image, in level pixels
+            const x0 = Math.max(0, (view.left - rect.left) / rect.width) * levelW;
+            const x1 = Math.min(1, (view.right - rect.left) / rect.width) * levelW;
+            const y0 = Math.max(0, (view.top - rect.top) / rect.height) * levelH;
+            const y1 = Math.min(1, (view.bottom - rect.top) / rect.height) * levelH;
+            if (x1 <= x0 || y1 <= y0) return;
+
+            for (let col = Math.floor(x0 / tileSize); col <= Math.floor((x1 - 1) / tileSize); col++) {
+                for (let row = Math.floor(y0 / tileSize); row <= Math.floor((y1 - 1) / tileSize); row++) {
+                    const key = `${col}_${row}`;
+                    if (tiles.has(key)) continue;
+                    const tx = Math.max(0, col * tileSize - overlap);
+                    const ty = Math.max(0, row * tileSize - overlap);
+                    const tw = Math.min(levelW, (col + 1) * tileSize + overlap) - tx;
+                    const th = Math.min(levelH, (row + 1) * tileSize + overlap) - ty;
+                    const tile = document.createElement('img');
+                    tile.decoding = 'async';
+                    Object.assign(tile.style, {
+                        position: 'absolute',
+                        left: `${tx / levelW * 100}%`,
+                        top: `${ty / levelH * 100}%`,
+                        width: `${tw / levelW * 100}%`,
+                        height: `${th / levelH * 100}%`,
+                        maxWidth: 'none',
+                        opacity: '0',
+                        transition: 'opacity 0.2s ease'
+                    });
+                    tile.onload = () => { tile.style.opacity = '1'; };
+                    tile.src = `./tiles/${imgName}_files/${level}/${key}.jpg`;
+                    layer.appendChild(tile);
+                    tiles.set(key, tile);
+                }
+            }
+        };
+
+        const schedule = () => {
+            if (!frame) frame = requestAnimationFrame(() => { frame = 0; render(); });
+        };
+        // Animated zooms report their final position only once the transition is over
+        layer.addEventListener('transitionend', (e) => { if (e.target === layer) schedule(); });
+
+        return {
+            element: layer,
+            update(zoomLevel, transform, transition) {
+                layer.style.transition = transition;
+                layer.style.transform = transform;
+                layer.style.display = zoomLevel > 1 ? 'block' : 'none';
+                if (zoomLevel > 1) schedule();
+            }
+        };
     }
 
     toggleMagnifier() {
@@ -1883,6 +2188,7 @@ class App {
             img.src = `./thumbs/${imgName}.jpg`;
             img.className = 'thumb-small';
             img.dataset.index = i;
+            img.hidden = !this.isVisible(i);
             img.onclick = (e) => {
                 e.stopPropagation();
                 this.selectImage(i, true);
@@ -0,0 +1,81 @@
+// Decoder for the BlurHash placeholders written by prepareSite.py (https://blurha.sh)
+const BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~';
+
+function decode83(str) {
+    let value = 0;
+    for (const c of str) value = value * 83 + BASE83.indexOf(c);
+    return value;
+}
+
+function sRGBToLinear(value) {
+    const v = value / 255;
+    return v <= 0.04045 ? v / 12.92 : Math.pow((v + 0.055) / 1.055, 2.4);
+}
+
+function linearToSRGB(value) {
+    const v = Math.max(0, Math.min(1, value));
+    return v <= 0.0031308 ? Math.round(v * 12.92 * 255) : Math.round((1.055 * Math.pow(v, 1 / 2.4) - 0.055) * 255);
+}
+
+function signPow(value, exp) {
+    return Math.sign(value) * Math.pow(Math.abs(value), exp);
+}
+
+// The first (DC) component is the image's mean colour: usable before anything is decoded
+export function blurhashColor(hash) {
+    const value = decode83(hash.substring(2, 6));
+    return `rgb(${value >> 16}, ${(value >> 8) & 255}, ${value & 255})`;
+}
+
+export function decodeBlurhash(hash, width, height) {
+    const sizeFlag = decode83(hash[0]);
+    const numX = (sizeFlag % 9) + 1;
+    const numY = Math.floor(sizeFlag / 9) + 1;
+    const maxValue = (decode83(hash[1]) + 1) / 166;
+
+    const colors = [];
+    const dc = decode83(hash.substring(2, 6));
+    colors.push([sRGBToLinear(dc >> 16), sRGBToLinear((dc >> 8) & 255), sRGBToLinear(dc & 255)]);
+    for (let i = 1; i < numX * numY; i++) {
+        const value = decode83(hash.substring(4 + i * 2, 6 + i * 2));
+        colors.push([
+            signPow((Math.floor(value / 361) - 9) / 9, 2) * maxValue,
+            signPow((Math.floor(value / 19) % 19 - 9) / 9, 2) * maxValue,
+            signPow((value % 19 - 9) / 9, 2) * maxValue
+        ]);
+    }
+
+    const pixels = new Uint8ClampedArray(width * height * 4);
+    for (let y = 0; y < height; y++) {
+        for (let x = 0; x < width; x++) {
+            let r = 0, g = 0, b = 0;
+            for (let j = 0; j < numY; j++) {
+                const basisY = Math.cos(Math.PI * y * j / height);
+                for (let i = 0; i < numX; i++) {
+                    const basis = Math.cos(Math.PI * x * i / width) * basisY;
+                    const color = colors[i + j * numX];
+                    r += color[0] * basis;
+                    g += color[1] * basis;
+                    b += color[2] * basis;
+                }
+            }
+            const p = 4 * (x + y * width);
+            pixels[p] = linearToSRGB(r);
+            pixels[p + 1] = linearToSRGB(g);
+            pixels[p + 2] = linearToSRGB(b);
+            pixels[p + 3] = 255;
+        }
+    }
+    return pixels;
+}
+
+// Rendered small and stretched by CSS; one shared canvas for every thumbnail
+let canvas = null;
+export function blurhashToDataURL(hash, width = 32, height = 32) {
+    if (!canvas) canvas = document.createElement('canvas');
+    canvas.width = width;
+    canvas.height = height;
+    const ctx = canvas.getContext('2d');
+    ctx.putImageData(new ImageData(decodeBlurhash(hash, width, height), width, height), 0, 0);
+    return canvas.toDataURL();
+}
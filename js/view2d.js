@@ -1,3 +1,5 @@
+import { blurhashColor, blurhashToDataURL } from './blurhash.js';
+
 export class View2D {
     constructor(container) {
         this.container = container;
@@ -22,6 +24,17 @@ export class View2D {
             this.container.innerHTML = '<p style="color:white;text-align:center;">No images found.</p>';
             return;
         }
+        if (this.placeholderObserver) this.placeholderObserver.disconnect();
+        this.placeholderObserver = new IntersectionObserver(entries => {
+            entries.forEach(entry => {
+                if (!entry.isIntersecting) return;
+                const thumb = entry.target;
+                this.placeholderObserver.unobserve(thumb);
+                if (!thumb.classList.contains('loaded')) {
+                    thumb.style.backgroundImage = `url(${blurhashToDataURL(thumb.dataset.blurhash)})`;
+                }
+            });
+        }, { rootMargin: '200px' });
         this.images.forEach((imgName, index) => {
             const thumb = document.createElement('div');
             thumb.className = 'thumb';
@@ -33,11 +46,16 @@ export class View2D {
             const h = meta && meta['Image Height'];
             if (w && h) thumb.style.aspectRatio = `${w} / ${h}`;
 
-            if (meta && meta.lqip) {
-                thumb.style.backgroundImage = `url(${meta.lqip})`;
-                thumb.style.backgroundSize = 'cover';
-                thumb.style.backgroundPosition = 'center';
+            if (meta && meta.blurhash) {
+                // Mean colour now, the blurred preview once the cell nears the viewport
+                thumb.style.backgroundColor = blurhashColor(meta.blurhash);
+                thumb.dataset.blurhash = meta.blurhash;
+                this.placeholderObserver.observe(thumb);
+            } else if (meta && meta.lqip) {
+                thumb.style.backgroundImage = `url(${meta.lqip})`; // Older builds: inline JPEG
             }
+            thumb.style.backgroundSize = 'cover';
+            thumb.style.backgroundPosition = 'center';
 
             const img = document.createElement('img');
             img.loading = 'lazy';
@@ -81,6 +99,14 @@ export class View2D {
         this.container.appendChild(spacer);
     }
 
+    // Hide the thumbnails not in `shown` (a Set of indices; null shows all)
+    setVisible(shown) {
+        const thumbs = this.container.getElementsByClassName('thumb');
+        for (let i = 0; i < thumbs.length; i++) {
+            thumbs[i].hidden = !!shown && !shown.has(i);
+        }
+    }
+
     goToIndex(index) {
         // Highlight active thumbnail
         const thumbs = this.container.getElementsByClassName('thumb');
@@ -36,8 +36,9 @@ export class View3D {
         this.animationId = null;
     }
 
-    init(images, onSelect, onPreload, isMobile = false, isDebug = false, onMagnify = null) {
+    init(images, onSelect, onPreload, isMobile = false, isDebug = false, onMagnify = null, atlas = null) {
         this.onMagnify = onMagnify;
+        this.atlas = atlas;
         if (!THREE) {
             console.error("Three.js not loaded");
             return;
@@ -141,7 +142,8 @@ export class View3D {
                 transparent: true // In case we want to fade them in/out later
             });
 
-            const mesh = new THREE.Mesh(geometry, material);
+            const cell = this.atlas && this.atlas.images[this.images[i]];
+            const mesh = new THREE.Mesh(cell ? this.atlasGeometry(cell) : geometry, material);
             mesh.position.set(x, y, z);
 
             // Set initial scale to placeholders
@@ -154,10 +156,19 @@ export class View3D {
             // We want them to point slightly more "outward" but maintain a pleasant curve
             mesh.lookAt(vector.x * 2, vector.y * 2, vector.z * 2);
 
-            mesh.userData = { index: i, originalPos: mesh.position.clone() };
+            mesh.userData = { index: i, originalPos: mesh.position.clone(), atlas: !!cell };
             this.pivot.add(mesh);
             this.frames.push(mesh);
 
+            // Atlas: share the sheet texture, the cell is selected through the UVs
+            if (cell) {
+                const REF_HEIGHT = this.isMobile ? 8 : 5;
+                mesh.scale.set(REF_HEIGHT * cell[3] / cell[4], REF_HEIGHT, 1);
+                material.map = this.atlasTexture(cell[0]);
+                material.needsUpdate = true;
+                continue;
+            }
+
             // Lazy Load Texture
             const imgName = this.images[i];
             new THREE.TextureLoader().load(`./thumbs/${imgName}.jpg`, (tex) => {
@@ -179,6 +190,29 @@ export class View3D {
         }
     }
 
+    atlasTexture(sheet) {
+        // One request and one GPU upload per sheet, shared by every photo on it
+        if (!this.atlasTextures) this.atlasTextures = new Map();
+        if (!this.atlasTextures.has(sheet)) {
+            const tex = new THREE.TextureLoader().load(`./atlas/${sheet}.jpg?v=${this.atlas.sheets[sheet]}`);
+            tex.encoding = THREE.sRGBEncoding;
+            tex.minFilter = THREE.LinearFilter;
+            this.atlasTextures.set(sheet, tex);
+        }
+        return this.atlasTextures.get(sheet);
+    }
+
+    atlasGeometry(cell) {
+        // Unit plane whose UVs cover just this photo's rectangle on the sheet
+        const [, x, y, w, h] = cell;
+        const size = this.atlas.sheet_size;
+        const u0 = x / size, u1 = (x + w) / size;
+        const v0 = 1 - (y + h) / size, v1 = 1 - y / size; // Textures are flipped vertically
+        const geometry = new THREE.PlaneGeometry(1, 1);
+        geometry.setAttribute('uv', new THREE.Float32BufferAttribute([u0, v1, u1, v1, u0, v0, u1, v0], 2));
+        return geometry;
+    }
+
     createParticles() {
         this.particleGroup = new THREE.Group();
         this.scene.add(this.particleGroup);
@@ -422,7 +456,7 @@ export class View3D {
             );
 
             this.raycaster.setFromCamera(mouse, this.camera);
-            const intersects = this.raycaster.intersectObjects(this.pivot.children);
+            const intersects = this.raycaster.intersectObjects(this.pivot.children).filter(hit => hit.object.visible);
 
             if (intersects.length > 0) {
                 const idx = intersects[0].object.userData.index;
@@ -558,6 +592,13 @@ export class View3D {
         this.onSelect(index, true);
     }
 
+    // Hide the frames not in `shown` (a Set of indices; null shows all); they keep their place on the sphere
+    setVisible(shown) {
+        this.frames.forEach((mesh, i) => {
+            mesh.visible = !shown || shown.has(i);
+        });
+    }
+
     goToIndex(index) {
         if (this.frames[index]) {
             this.currentIndex = index;
@@ -669,7 +710,7 @@ export class View3D {
                     this.pivot.remove(f);
                     if (f.geometry) f.geometry.dispose();
                     if (f.material) {
-                        if (f.material.map) f.material.map.dispose();
+                        if (f.material.map && !f.userData.atlas) f.material.map.dispose(); // Sheets are shared
                         f.material.dispose();
                     }
                 });
@@ -8,6 +8,7 @@ set DIST_DIR=_site
 
 if "%1"=="" goto build
 if "%1"=="build" goto build
+if "%1"=="watch" goto watch
 if "%1"=="install" goto install
 if "%1"=="dist" goto dist
 if "%1"=="clean" goto clean
@@ -28,7 +29,12 @@ goto :eof
 
 :build
 if not exist %VENV% call :install
-%PYTHON% prepareSite.py -n 25 -q 85
+%PYTHON% prepareSite.py -n 25 -q 85 --widths 640,1280,2560 --atlas
+goto :eof
+
+:watch
+if not exist %VENV% call :install
+%PYTHON% prepareSite.py -n 25 -q 85 --widths 640,1280,2560 --atlas --watch
 goto :eof
 
 :dist
@@ -44,13 +50,21 @@ xcopy css %DIST_DIR%\css\ /S /E /I /Y >nul
 xcopy js %DIST_DIR%\js\ /S /E /I /Y >nul
 xcopy fulls %DIST_DIR%\fulls\ /S /E /I /Y >nul
 xcopy metadata %DIST_DIR%\metadata\ /S /E /I /Y >nul
+if exist %DIST_DIR%\metadata\metadata.json del %DIST_DIR%\metadata\metadata.json
 xcopy thumbs %DIST_DIR%\thumbs\ /S /E /I /Y >nul
+if exist sizes xcopy sizes %DIST_DIR%\sizes\ /S /E /I /Y >nul
+if exist atlas xcopy atlas %DIST_DIR%\atlas\ /S /E /I /Y >nul
+if exist tiles xcopy tiles %DIST_DIR%\tiles\ /S /E /I /Y >nul
 echo Distribution prepared in %DIST_DIR%
 goto :eof
 
 :clean
 if exist thumbs rd /s /q thumbs
+if exist sizes rd /s /q sizes
+if exist atlas rd /s /q atlas
+if exist tiles rd /s /q tiles
 if exist metadata rd /s /q metadata
+if exist .cache rd /s /q .cache
 if exist %DIST_DIR% rd /s /q %DIST_DIR%
 echo Cleaned build artifacts.
 goto :eof
@@ -65,7 +79,8 @@ goto :eof
 echo Gallery Build System Commands:
 echo   make.bat install   - Create virtual environment and install dependencies
 echo   make.bat build     - Build the site using the local environment (default)
-echo   make.bat clean     - Remove build artifacts (thumbs, metadata, _site)
+echo   make.bat watch     - Build, then rebuild whenever images in fulls change
+echo   make.bat clean     - Remove build artifacts (thumbs, sizes, atlas, tiles, metadata, .cache, _site)
 echo   make.bat deepclean - Remove artifacts and the virtual environment
 echo   make.bat dist      - Prepare the _site directory for deployment
 echo   make.bat help      - Show this help message
@@ -1,13 +1,26 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, jsonify
+from flask import Flask, render_template, request, redirect, url_for, send_from_directory, send_file, jsonify
 import piexif
 from PIL import Image
 import base64
 import io
+import json
+import hashlib
+import struct
+import tempfile
 import argparse
+import uuid
+import fnmatch
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import cpu_count
 import sys # Import sys for sys.exit()
 import signal # Import signal for os.kill()
 
+# Reuse the site build's decode/resize/encode backends so editor previews match the gallery thumbnails
+from prepareSite import buildParser, buildOptions, chooseEngine, backend
+
 # Initialize the Flask application
 app = Flask(__name__)
 
@@ -85,6 +98,81 @@ def get_metering_mode(value):
     }
     return metering_map.get(value, f"Unknown ({value})")
 
+# --- Helper Functions for Writing EXIF ---
+
+def splice_exif(data, exif_bytes):
+    """
+    Returns the JPEG bytes with its Exif APP1 segment replaced by exif_bytes (as made by piexif.dump).
+    The marker segments are walked the same way as read_exif_header in prepareSite.py. The new
+    segment goes right after SOI and any leading APP0 (JFIF) segments, existing Exif APP1 segments
+    are dropped, and every other segment (JFIF, XMP, ICC profile, ...) and all the data from the
+    start of scan on are copied unchanged.
+    Raises ValueError for a malformed JPEG or EXIF that doesn't fit in one segment.
+    """
+    if len(exif_bytes) + 2 > 0xFFFF:
+        raise ValueError("EXIF data is too large for a JPEG APP1 segment")
+    segment = b'\xff\xe1' + struct.pack('>H', len(exif_bytes) + 2) + exif_bytes
+
+    output = [data[:2]]
+    pos = 2
+    spliced = False
+    while True:
+        if pos + 2 > len(data) or data[pos] != 0xFF:
+            raise ValueError("Malformed JPEG: no start of scan found")
+        while pos + 1 < len(data) and data[pos + 1] == 0xFF: # Fill bytes
+            pos += 1
+        marker = data[pos + 1]
+        if not spliced and marker != 0xE0:
+            output.append(segment) # No Exif among the leading segments: insert it here
+            spliced = True
+        if marker in (0xD9, 0xDA): # EOI / start of scan: the rest is image data
+            output.append(data[pos:])
+            return b''.join(output)
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7: # Standalone markers carry no length
+            output.append(data[pos:pos + 2])
+            pos += 2
+            continue
+        if pos + 4 > len(data):
+            raise ValueError("Malformed JPEG: truncated segment")
+        end = pos + 2 + struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if end > len(data):
+            raise ValueError("Malformed JPEG: truncated segment")
+        if not (marker == 0xE1 and data[pos + 4:pos + 10] == b'Exif\x00\x00'):
+            output.append(data[pos:end])
+        pos = end
+
+def write_exif(filepath, exif_bytes):
+    """
+    Replaces the EXIF of an image without re-encoding it.
+    For JPEGs only the Exif APP1 segment is swapped (see splice_exif): every other segment, the
+    compressed image data and quantization tables are copied byte for byte.
+    Other formats have no such segment and are re-saved with Pillow.
+    The result is written to a temporary file next to the original and renamed over it, so a crash
+    mid-write never leaves a truncated original behind.
+    """
+    with open(filepath, 'rb') as f:
+        data = f.read()
+
+    output = io.BytesIO()
+    if data[:2] == b'\xff\xd8': # JPEG SOI marker
+        output.write(splice_exif(data, exif_bytes))
+    else:
+        with Image.open(io.BytesIO(data)) as img:
+            img.save(output, format=img.format, exif=exif_bytes)
+
+    # The temporary file must live in the same directory for os.replace to be an atomic rename
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filepath) or '.', prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(output.getvalue())
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, os.stat(filepath).st_mode & 0o7777) # Keep the original's permissions
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
 # Define the directory where images are stored. This directory must be created.
 UPLOAD_FOLDER = 'fulls'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -97,6 +185,150 @@ if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
     print(f"Created directory: {UPLOAD_FOLDER}")
 
+# --- Parsed EXIF Cache ---
+
+# Supported image file extensions for the editor listing
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff')
+
+# Maximum number of parsed EXIF entries kept in memory (a few KB each), whatever the directory size
+EXIF_CACHE_SIZE = 4096
+
+# Number of image cards rendered per listing page
+IMAGES_PER_PAGE = 9
+
+exif_cache = OrderedDict() # filepath -> (mtime_ns, size, exif_data), least recently used first
+exif_cache_lock = threading.Lock() # The development server handles requests on several threads
+
+def parse_exif(filepath):
+    """
+    Opens an image and decodes its common EXIF tags into a flat dictionary of display values.
+    Pillow only reads the header here, the pixel data is never decoded.
+    GPS is returned both as floats (latitude/longitude) and as formatted strings (GPSLatitude/GPSLongitude).
+    """
+    exif_data = {"latitude": None, "longitude": None}
+    with Image.open(filepath) as img:
+        if "exif" not in img.info:
+            return exif_data
+        exif_dict = piexif.load(img.info["exif"])
+        # Image Dimensions from Pillow (not EXIF but useful for resolution display)
+        exif_data["ImageWidth"] = img.width
+        exif_data["ImageHeight"] = img.height
+
+    # --- Extract and decode common EXIF tags ---
+    # 0th IFD (Image File Directory)
+    if piexif.ImageIFD.Make in exif_dict["0th"]:
+        exif_data["Make"] = exif_dict["0th"][piexif.ImageIFD.Make].decode('utf-8')
+    if piexif.ImageIFD.Model in exif_dict["0th"]:
+        exif_data["Model"] = exif_dict["0th"][piexif.ImageIFD.Model].decode('utf-8')
+    if piexif.ImageIFD.DateTime in exif_dict["0th"]:
+        exif_data["DateTime"] = exif_dict["0th"][piexif.ImageIFD.DateTime].decode('utf-8')
+    if piexif.ImageIFD.Artist in exif_dict["0th"]:
+        exif_data["Artist"] = exif_dict["0th"][piexif.ImageIFD.Artist].decode('utf-8')
+    if piexif.ImageIFD.Copyright in exif_dict["0th"]:
+        exif_data["Copyright"] = exif_dict["0th"][piexif.ImageIFD.Copyright].decode('utf-8')
+    if piexif.ImageIFD.XResolution in exif_dict["0th"]:
+        exif_data["XResolution"] = format_rational(exif_dict["0th"][piexif.ImageIFD.XResolution])
+    if piexif.ImageIFD.YResolution in exif_dict["0th"]:
+        exif_data["YResolution"] = format_rational(exif_dict["0th"][piexif.ImageIFD.YResolution])
+
+    # Exif IFD
+    if piexif.ExifIFD.DateTimeOriginal in exif_dict["Exif"]:
+        exif_data["DateTimeOriginal"] = exif_dict["Exif"][piexif.ExifIFD.DateTimeOriginal].decode('utf-8')
+    if piexif.ExifIFD.DateTimeDigitized in exif_dict["Exif"]:
+        exif_data["DateTimeDigitized"] = exif_dict["Exif"][piexif.ExifIFD.DateTimeDigitized].decode('utf-8')
+    if piexif.ExifIFD.ExposureTime in exif_dict["Exif"]:
+        exif_data["ExposureTime"] = format_rational(exif_dict["Exif"][piexif.ExifIFD.ExposureTime]) + " s"
+    if piexif.ExifIFD.FNumber in exif_dict["Exif"]:
+        exif_data["FNumber"] = "f/" + format_rational(exif_dict["Exif"][piexif.ExifIFD.FNumber])
+    if piexif.ExifIFD.ISOSpeedRatings in exif_dict["Exif"]:
+        exif_data["ISOSpeedRatings"] = exif_dict["Exif"][piexif.ExifIFD.ISOSpeedRatings]
+    if piexif.ExifIFD.FocalLength in exif_dict["Exif"]:
+        exif_data["FocalLength"] = format_rational(exif_dict["Exif"][piexif.ExifIFD.FocalLength]) + " mm"
+    if piexif.ExifIFD.Flash in exif_dict["Exif"]:
+        exif_data["Flash"] = get_flash_mode(exif_dict["Exif"][piexif.ExifIFD.Flash])
+    if piexif.ExifIFD.MeteringMode in exif_dict["Exif"]:
+        exif_data["MeteringMode"] = get_metering_mode(exif_dict["Exif"][piexif.ExifIFD.MeteringMode])
+    if piexif.ExifIFD.PixelXDimension in exif_dict["Exif"]:
+        exif_data["PixelXDimension"] = exif_dict["Exif"][piexif.ExifIFD.PixelXDimension]
+    if piexif.ExifIFD.PixelYDimension in exif_dict["Exif"]:
+        exif_data["PixelYDimension"] = exif_dict["Exif"][piexif.ExifIFD.PixelYDimension]
+
+    # GPS IFD
+    if piexif.GPSIFD.GPSLatitude in exif_dict["GPS"] and \
+       piexif.GPSIFD.GPSLongitude in exif_dict["GPS"]:
+        lat_dms = exif_dict["GPS"][piexif.GPSIFD.GPSLatitude]
+        lon_dms = exif_dict["GPS"][piexif.GPSIFD.GPSLongitude]
+        lat_ref = exif_dict["GPS"][piexif.GPSIFD.GPSLatitudeRef].decode('utf-8')
+        lon_ref = exif_dict["GPS"][piexif.GPSIFD.GPSLongitudeRef].decode('utf-8')
+
+        exif_data["latitude"] = dms_to_decimal(lat_dms, lat_ref)
+        exif_data["longitude"] = dms_to_decimal(lon_dms, lon_ref)
+        exif_data["GPSLatitude"] = f"{exif_data['latitude']:.6f}" # Format to 6 decimal places
+        exif_data["GPSLongitude"] = f"{exif_data['longitude']:.6f}"
+
+    return exif_data
+
+def get_exif(filepath):
+    """
+    Returns the parsed EXIF for an image, parsing it only if the file changed since it was cached.
+    Entries are keyed by path and validated against the file's mtime and size, so edits made
+    outside the editor are picked up too. The cache is bounded to EXIF_CACHE_SIZE entries (LRU).
+    """
+    stat = os.stat(filepath)
+    with exif_cache_lock:
+        cached = exif_cache.get(filepath)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            exif_cache.move_to_end(filepath)
+            return cached[2]
+
+    # Parse outside the lock so other requests are not held up by this file
+    exif_data = parse_exif(filepath)
+    with exif_cache_lock:
+        exif_cache[filepath] = (stat.st_mtime_ns, stat.st_size, exif_data)
+        exif_cache.move_to_end(filepath)
+        while len(exif_cache) > EXIF_CACHE_SIZE:
+            exif_cache.popitem(last=False)
+    return exif_data
+
+def invalidate_exif(filepath):
+    """Drops an image from the EXIF cache, e.g. after its metadata has been modified."""
+    with exif_cache_lock:
+        exif_cache.pop(filepath, None)
+
+def list_image_files():
+    """Returns the sorted image filenames in the UPLOAD_FOLDER. Only names are read, no file is opened."""
+    with os.scandir(app.config['UPLOAD_FOLDER']) as entries:
+        return sorted(entry.name for entry in entries
+                      if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS))
+
+def list_image_stats():
+    """Returns (filename, mtime_ns, size) for every image in the UPLOAD_FOLDER, sorted by filename."""
+    with os.scandir(app.config['UPLOAD_FOLDER']) as entries:
+        stats = []
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                stat = entry.stat()
+                stats.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    return sorted(stats)
+
+def get_image_page(filenames, page, per_page=IMAGES_PER_PAGE):
+    """
+    Returns the EXIF of the images on one listing page, along with the clamped page number and page count.
+    Only the images on the requested page are parsed (or fetched from the cache).
+    """
+    total_pages = max(1, -(-len(filenames) // per_page))
+    page = max(1, min(page, total_pages))
+    images = []
+    for filename in filenames[(page - 1) * per_page:page * per_page]:
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        try:
+            exif_data = get_exif(filepath)
+        except Exception as e:
+            print(f"Error reading EXIF for {filename}: {e}")
+            exif_data = {"Error": f"Could not read EXIF: {e}"}
+        images.append({'filename': filename, 'exif': exif_data})
+    return images, page, total_pages
+
 # --- Flask Routes ---
 
 @app.route('/')
@@ -104,92 +336,64 @@ def index():
     """
     Renders the main page, listing images from the 'fulls' directory
     and displaying their extracted EXIF data.
+    Only the requested page of images (?page=N) is parsed; further pages are fetched from /images.
     """
-    images = []
     try:
-        # Iterate through files in the UPLOAD_FOLDER
-        for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-            # Only process common image file extensions
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff')):
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                exif_data = {} # Dictionary to store EXIF data for display
-
-                try:
-                    # Open the image using Pillow
-                    img = Image.open(filepath)
-                    # Check if the image has EXIF data
-                    if "exif" in img.info:
-                        # Load EXIF data using piexif
-                        exif_dict = piexif.load(img.info["exif"])
-
-                        # --- Extract and decode common EXIF tags ---
-                        # 0th IFD (Image File Directory)
-                        if piexif.ImageIFD.Make in exif_dict["0th"]:
-                            exif_data["Make"] = exif_dict["0th"][piexif.ImageIFD.Make].decode('utf-8')
-                        if piexif.ImageIFD.Model in exif_dict["0th"]:
-                            exif_data["Model"] = exif_dict["0th"][piexif.ImageIFD.Model].decode('utf-8')
-                        if piexif.ImageIFD.DateTime in exif_dict["0th"]:
-                            exif_data["DateTime"] = exif_dict["0th"][piexif.ImageIFD.DateTime].decode('utf-8')
-                        if piexif.ImageIFD.Artist in exif_dict["0th"]:
-                            exif_data["Artist"] = exif_dict["0th"][piexif.ImageIFD.Artist].decode('utf-8')
-                        if piexif.ImageIFD.Copyright in exif_dict["0th"]:
-                            exif_data["Copyright"] = exif_dict["0th"][piexif.ImageIFD.Copyright].decode('utf-8')
-                        if piexif.ImageIFD.XResolution in exif_dict["0th"]:
-                            exif_data["XResolution"] = format_rational(exif_dict["0th"][piexif.ImageIFD.XResolution])
-                        if piexif.ImageIFD.YResolution in exif_dict["0th"]:
-                            exif_data["YResolution"] = format_rational(exif_dict["0th"][piexif.ImageIFD.YResolution])
-
-                        # Exif IFD
-                        if piexif.ExifIFD.DateTimeOriginal in exif_dict["Exif"]:
-                            exif_data["DateTimeOriginal"] = exif_dict["Exif"][piexif.ExifIFD.DateTimeOriginal].decode('utf-8')
-                        if piexif.ExifIFD.DateTimeDigitized in exif_dict["Exif"]:
-                            exif_data["DateTimeDigitized"] = exif_dict["Exif"][piexif.ExifIFD.DateTimeDigitized].decode('utf-8')
-                        if piexif.ExifIFD.ExposureTime in exif_dict["Exif"]:
-                            exif_data["ExposureTime"] = format_rational(exif_dict["Exif"][piexif.ExifIFD.ExposureTime]) + " s"
-                        if piexif.ExifIFD.FNumber in exif_dict["Exif"]:
-                            exif_data["FNumber"] = "f/" + format_rational(exif_dict["Exif"][piexif.ExifIFD.FNumber])
-                        if piexif.ExifIFD.ISOSpeedRatings in exif_dict["Exif"]:
-                            exif_data["ISOSpeedRatings"] = exif_dict["Exif"][piexif.ExifIFD.ISOSpeedRatings]
-                        if piexif.ExifIFD.FocalLength in exif_dict["Exif"]:
-                            exif_data["FocalLength"] = format_rational(exif_dict["Exif"][piexif.ExifIFD.FocalLength]) + " mm"
-                        if piexif.ExifIFD.Flash in exif_dict["Exif"]:
-                            exif_data["Flash"] = get_flash_mode(exif_dict["Exif"][piexif.ExifIFD.Flash])
-                        if piexif.ExifIFD.MeteringMode in exif_dict["Exif"]:
-                            exif_data["MeteringMode"] = get_metering_mode(exif_dict["Exif"][piexif.ExifIFD.MeteringMode])
-                        if piexif.ExifIFD.PixelXDimension in exif_dict["Exif"]:
-                            exif_data["PixelXDimension"] = exif_dict["Exif"][piexif.ExifIFD.PixelXDimension]
-                        if piexif.ExifIFD.PixelYDimension in exif_dict["Exif"]:
-                            exif_data["PixelYDimension"] = exif_dict["Exif"][piexif.ExifIFD.PixelYDimension]
-                        
-                        # Image Dimensions from Pillow (not EXIF but useful for resolution display)
-                        exif_data["ImageWidth"] = img.width
-                        exif_data["ImageHeight"] = img.height
-
-
-                        # GPS IFD
-                        if piexif.GPSIFD.GPSLatitude in exif_dict["GPS"] and \
-                           piexif.GPSIFD.GPSLongitude in exif_dict["GPS"]:
-                            lat_dms = exif_dict["GPS"][piexif.GPSIFD.GPSLatitude]
-                            lon_dms = exif_dict["GPS"][piexif.GPSIFD.GPSLongitude]
-                            lat_ref = exif_dict["GPS"][piexif.GPSIFD.GPSLatitudeRef].decode('utf-8')
-                            lon_ref = exif_dict["GPS"][piexif.GPSIFD.GPSLongitudeRef].decode('utf-8')
-
-                            latitude = dms_to_decimal(lat_dms, lat_ref)
-                            longitude = dms_to_decimal(lon_dms, lon_ref)
-                            exif_data["GPSLatitude"] = f"{latitude:.6f}" # Format to 6 decimal places
-                            exif_data["GPSLongitude"] = f"{longitude:.6f}"
-
-                except Exception as e:
-                    print(f"Error reading EXIF for {filename}: {e}")
-                    exif_data["Error"] = f"Could not read EXIF: {e}"
-
-                images.append({'filename': filename, 'exif': exif_data})
+        stats = list_image_stats()
+        filenames = [name for name, _, _ in stats]
+        versions = {name: mtime for name, mtime, _ in stats} # Cache busting for /preview URLs
+        images, page, total_pages = get_image_page(filenames, request.args.get('page', 1, type=int))
     except FileNotFoundError:
         return f"The '{app.config['UPLOAD_FOLDER']}' directory was not found. Please create it and place images inside, or specify a valid path using --fulls.", 500
     except Exception as e:
         return f"An unexpected error occurred: {e}", 500
 
-    return render_template('exif.html', images=images)
+    return render_template('exif.html', filenames=filenames, versions=versions, images=images, page=page, total_pages=total_pages)
+
+@app.route('/images')
+def list_images():
+    """
+    Returns one page of the image listing as JSON: {"images": [{"filename", "exif"}], "page", "total_pages"}.
+    Used by the page's pagination so switching pages doesn't re-render (or re-parse) the whole listing.
+    """
+    try:
+        images, page, total_pages = get_image_page(list_image_files(), request.args.get('page', 1, type=int),
+                                                   min(max(request.args.get('per_page', IMAGES_PER_PAGE, type=int), 1), 100))
+    except FileNotFoundError:
+        return jsonify({"error": "Image directory not found"}), 404
+    return jsonify({"images": images, "page": page, "total_pages": total_pages})
+
+@app.route('/exif')
+def bulk_exif():
+    """
+    Returns the decoded EXIF of many images in one compact JSON object keyed by filename.
+    ?files=a.jpg&files=b.jpg (repeated, so names may contain commas) restricts it to those images,
+    otherwise every image is included.
+    The response carries a strong ETag built from the filenames, mtimes and sizes, so a client
+    revalidating with If-None-Match gets a 304 without a single file being opened.
+    """
+    try:
+        stats = list_image_stats()
+    except FileNotFoundError:
+        return jsonify({"error": "Image directory not found"}), 404
+    if 'files' in request.args:
+        requested = set(request.args.getlist('files'))
+        stats = [stat for stat in stats if stat[0] in requested]
+
+    etag = hashlib.sha1('\n'.join(f'{name}:{mtime}:{size}' for name, mtime, size in stats).encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        exif_by_file = {}
+        for name, _, _ in stats:
+            try:
+                exif_by_file[name] = get_exif(os.path.join(app.config['UPLOAD_FOLDER'], name))
+            except Exception as e:
+                exif_by_file[name] = {"error": f"Could not read EXIF: {e}"}
+        response = app.response_class(json.dumps(exif_by_file, separators=(',', ':')), mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache' # Always revalidate, the ETag keeps that cheap
+    return response
 
 @app.route('/get_exif_gps/<filename>')
 def get_exif_gps(filename):
@@ -201,65 +405,65 @@ def get_exif_gps(filename):
     if not os.path.exists(filepath):
         return jsonify({"error": "File not found"}), 404
 
-    exif_data_for_js = {"latitude": None, "longitude": None}
     try:
-        img = Image.open(filepath)
-        if "exif" in img.info:
-            exif_dict = piexif.load(img.info["exif"])
-
-            # GPS Data
-            if piexif.GPSIFD.GPSLatitude in exif_dict["GPS"] and \
-               piexif.GPSIFD.GPSLongitude in exif_dict["GPS"]:
-                lat_dms = exif_dict["GPS"][piexif.GPSIFD.GPSLatitude]
-                lon_dms = exif_dict["GPS"][piexif.GPSIFD.GPSLongitude]
-                lat_ref = exif_dict["GPS"][piexif.GPSIFD.GPSLatitudeRef].decode('utf-8')
-                lon_ref = exif_dict["GPS"][piexif.GPSIFD.GPSLongitudeRef].decode('utf-8')
-                exif_data_for_js["latitude"] = dms_to_decimal(lat_dms, lat_ref)
-                exif_data_for_js["longitude"] = dms_to_decimal(lon_dms, lon_ref)
-            
-            # Add other EXIF data to the JSON response for potential future use in JS
-            if piexif.ImageIFD.Make in exif_dict["0th"]:
-                exif_data_for_js["Make"] = exif_dict["0th"][piexif.ImageIFD.Make].decode('utf-8')
-            if piexif.ImageIFD.Model in exif_dict["0th"]:
-                exif_data_for_js["Model"] = exif_dict["0th"][piexif.ImageIFD.Model].decode('utf-8')
-            if piexif.ExifIFD.DateTimeOriginal in exif_dict["Exif"]:
-                exif_data_for_js["DateTimeOriginal"] = exif_dict["Exif"][piexif.ExifIFD.DateTimeOriginal].decode('utf-8')
-            if piexif.ExifIFD.ExposureTime in exif_dict["Exif"]:
-                exif_data_for_js["ExposureTime"] = format_rational(exif_dict["Exif"][piexif.ExifIFD.ExposureTime]) + " s"
-            if piexif.ExifIFD.FNumber in exif_dict["Exif"]:
-                exif_data_for_js["FNumber"] = "f/" + format_rational(exif_dict["Exif"][piexif.ExifIFD.FNumber])
-            if piexif.ExifIFD.ISOSpeedRatings in exif_dict["Exif"]:
-                exif_data_for_js["ISOSpeedRatings"] = exif_dict["Exif"][piexif.ExifIFD.ISOSpeedRatings]
-            if piexif.ExifIFD.FocalLength in exif_dict["Exif"]:
-                exif_data_for_js["FocalLength"] = format_rational(exif_dict["Exif"][piexif.ExifIFD.FocalLength]) + " mm"
-            if piexif.ImageIFD.XResolution in exif_dict["0th"]:
-                exif_data_for_js["XResolution"] = format_rational(exif_dict["0th"][piexif.ImageIFD.XResolution])
-            if piexif.ImageIFD.YResolution in exif_dict["0th"]:
-                exif_data_for_js["YResolution"] = format_rational(exif_dict["0th"][piexif.ImageIFD.YResolution])
-            if piexif.ImageIFD.Artist in exif_dict["0th"]:
-                exif_data_for_js["Artist"] = exif_dict["0th"][piexif.ImageIFD.Artist].decode('utf-8')
-            if piexif.ImageIFD.Copyright in exif_dict["0th"]:
-                exif_data_for_js["Copyright"] = exif_dict["0th"][piexif.ImageIFD.Copyright].decode('utf-8')
-            if piexif.ExifIFD.PixelXDimension in exif_dict["Exif"]:
-                exif_data_for_js["PixelXDimension"] = exif_dict["Exif"][piexif.ExifIFD.PixelXDimension]
-            if piexif.ExifIFD.PixelYDimension in exif_dict["Exif"]:
-                exif_data_for_js["PixelYDimension"] = exif_dict["Exif"][piexif.ExifIFD.PixelYDimension]
-            
-            # Image Dimensions from Pillow (not EXIF but useful for resolution display)
-            exif_data_for_js["ImageWidth"] = img.width
-            exif_data_for_js["ImageHeight"] = img.height
-
-            if piexif.ExifIFD.Flash in exif_dict["Exif"]:
-                exif_data_for_js["Flash"] = get_flash_mode(exif_dict["Exif"][piexif.ExifIFD.Flash])
-            if piexif.ExifIFD.MeteringMode in exif_dict["Exif"]:
-                exif_data_for_js["MeteringMode"] = get_metering_mode(exif_dict["Exif"][piexif.ExifIFD.MeteringMode])
-
-        return jsonify(exif_data_for_js)
+        return jsonify(get_exif(filepath))
     except Exception as e:
         print(f"Error getting EXIF GPS for {filename}: {e}")
         return jsonify({"error": f"Could not read EXIF GPS: {e}"}), 500
 
 
+def update_exif(filepath, latitude=None, longitude=None, artist=None, copyright_info=None):
+    """
+    Applies the editable fields to an image's EXIF and writes it back in place.
+    GPS is only set when both latitude and longitude (decimal degrees) are given;
+    empty strings or None leave a field untouched.
+    """
+    # Open the image (only the header is read, the pixels are never decoded)
+    with Image.open(filepath) as img:
+        exif_info = img.info.get("exif")
+    exif_dict = {}
+
+    # Load existing EXIF data if it exists in the image.
+    # If not, initialize an empty EXIF dictionary for all IFDs.
+    if exif_info:
+        exif_dict = piexif.load(exif_info)
+    else:
+        # Initialize all standard EXIF IFDs (Image File Directories)
+        exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "Interop": {}, "1st": {}, "thumbnail": None}
+
+    # --- Add/Modify GPS Data ---
+    # Only proceed if both latitude and longitude are provided
+    if latitude is not None and longitude is not None:
+        # Convert decimal degrees to the DMS (Degrees, Minutes, Seconds) format required by EXIF
+        lat_dms = decimal_to_dms(latitude)
+        lon_dms = decimal_to_dms(longitude)
+
+        # Set GPS tags in the GPS IFD
+        exif_dict["GPS"][piexif.GPSIFD.GPSLatitudeRef] = get_gps_ref(latitude, True).encode('ascii')
+        exif_dict["GPS"][piexif.GPSIFD.GPSLatitude] = lat_dms
+        exif_dict["GPS"][piexif.GPSIFD.GPSLongitudeRef] = get_gps_ref(longitude, False).encode('ascii')
+        exif_dict["GPS"][piexif.GPSIFD.GPSLongitude] = lon_dms
+        exif_dict["GPS"][piexif.GPSIFD.GPSVersionID] = (2, 0, 0, 0) # Standard GPS version ID
+        exif_dict["GPS"][piexif.GPSIFD.GPSAltitudeRef] = 0 # 0 for above sea level, 1 for below
+        exif_dict["GPS"][piexif.GPSIFD.GPSAltitude] = (0, 1) # Default altitude to 0 meters
+
+    # --- Add/Modify other EXIF data (0th IFD) ---
+    # Encode strings to bytes as required by piexif
+    if artist:
+        exif_dict["0th"][piexif.ImageIFD.Artist] = artist.encode('utf-8')
+    if copyright_info:
+        exif_dict["0th"][piexif.ImageIFD.Copyright] = copyright_info.encode('utf-8')
+
+    # Add a custom software tag to indicate this app modified the EXIF
+    exif_dict["0th"][piexif.ImageIFD.Software] = b"Flask EXIF Editor"
+
+    # Dump the EXIF dictionary into bytes format suitable for saving
+    exif_bytes = piexif.dump(exif_dict)
+
+    # Overwrite the original image file, splicing in the new EXIF without re-encoding
+    write_exif(filepath, exif_bytes)
+    invalidate_exif(filepath)
+
 @app.route('/modify_exif', methods=['POST'])
 def modify_exif():
     """
@@ -282,57 +486,16 @@ def modify_exif():
     if not os.path.exists(filepath):
         return f"File '{filename}' not found in the '{app.config['UPLOAD_FOLDER']}' directory.", 404
 
-    try:
-        # Open the image
-        img = Image.open(filepath)
-        exif_dict = {}
-
-        # Load existing EXIF data if it exists in the image.
-        # If not, initialize an empty EXIF dictionary for all IFDs.
-        if "exif" in img.info:
-            exif_dict = piexif.load(img.info["exif"])
-        else:
-            # Initialize all standard EXIF IFDs (Image File Directories)
-            exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "Interop": {}, "1st": {}, "thumbnail": None}
+    latitude = longitude = None
+    if latitude_str and longitude_str:
+        try:
+            latitude = float(latitude_str)
+            longitude = float(longitude_str)
+        except ValueError:
+            return "Invalid latitude or longitude format. Please enter numbers.", 400
 
-        # --- Add/Modify GPS Data ---
-        # Only proceed if both latitude and longitude are provided
-        if latitude_str and longitude_str:
-            try:
-                latitude = float(latitude_str)
-                longitude = float(longitude_str)
-
-                # Convert decimal degrees to the DMS (Degrees, Minutes, Seconds) format required by EXIF
-                lat_dms = decimal_to_dms(latitude)
-                lon_dms = decimal_to_dms(longitude)
-
-                # Set GPS tags in the GPS IFD
-                exif_dict["GPS"][piexif.GPSIFD.GPSLatitudeRef] = get_gps_ref(latitude, True).encode('ascii')
-                exif_dict["GPS"][piexif.GPSIFD.GPSLatitude] = lat_dms
-                exif_dict["GPS"][piexif.GPSIFD.GPSLongitudeRef] = get_gps_ref(longitude, False).encode('ascii')
-                exif_dict["GPS"][piexif.GPSIFD.GPSLongitude] = lon_dms
-                exif_dict["GPS"][piexif.GPSIFD.GPSVersionID] = (2, 0, 0, 0) # Standard GPS version ID
-                exif_dict["GPS"][piexif.GPSIFD.GPSAltitudeRef] = 0 # 0 for above sea level, 1 for below
-                exif_dict["GPS"][piexif.GPSIFD.GPSAltitude] = (0, 1) # Default altitude to 0 meters
-
-            except ValueError:
-                return "Invalid latitude or longitude format. Please enter numbers.", 400
-
-        # --- Add/Modify other EXIF data (0th IFD) ---
-        # Encode strings to bytes as required by piexif
-        if artist:
-            exif_dict["0th"][piexif.ImageIFD.Artist] = artist.encode('utf-8')
-        if copyright_info:
-            exif_dict["0th"][piexif.ImageIFD.Copyright] = copyright_info.encode('utf-8')
-        
-        # Add a custom software tag to indicate this app modified the EXIF
-        exif_dict["0th"][piexif.ImageIFD.Software] = b"Flask EXIF Editor"
-
-        # Dump the EXIF dictionary into bytes format suitable for saving
-        exif_bytes = piexif.dump(exif_dict)
-
-        # Overwrite the original image file
-        img.save(filepath, exif=exif_bytes)
+    try:
+        update_exif(filepath, latitude, longitude, artist, copyright_info)
 
         # Redirect back to the main page to show the updated list
         return redirect(url_for('index'))
@@ -341,6 +504,131 @@ def modify_exif():
         # Catch any errors during the EXIF modification and saving process
         return f"An error occurred during EXIF modification: {e}", 500
 
+# --- Batch EXIF Editing ---
+
+# Number of files written concurrently by a batch; the writes are I/O bound so threads suffice
+BATCH_WORKERS = 8
+
+# Number of finished batch jobs kept around for progress queries
+BATCH_JOB_HISTORY = 20
+
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+batch_jobs = OrderedDict() # job id -> {"total", "done", "failed", "finished", "results"}
+batch_jobs_lock = threading.Lock()
+
+def select_batch_files(payload):
+    """
+    Resolves the images a batch applies to. A batch can name its files explicitly ("files"),
+    match them with a glob pattern ("glob", e.g. "IMG_2023*.jpg") and/or restrict them to a
+    date range ("date_from"/"date_to" as YYYY-MM-DD, inclusive, on DateTimeOriginal or DateTime).
+    Only images in the UPLOAD_FOLDER listing can be selected.
+    """
+    filenames = list_image_files()
+    if payload.get("files") is not None:
+        requested = set(payload["files"])
+        filenames = [filename for filename in filenames if filename in requested]
+    if payload.get("glob"):
+        filenames = [filename for filename in filenames if fnmatch.fnmatch(filename, payload["glob"])]
+
+    date_from = payload.get("date_from")
+    date_to = payload.get("date_to")
+    if date_from or date_to:
+        # EXIF dates are "YYYY:MM:DD HH:MM:SS", so comparing the first 10 characters compares days
+        date_from = date_from.replace('-', ':')[:10] if date_from else None
+        date_to = date_to.replace('-', ':')[:10] if date_to else None
+        selected = []
+        for filename in filenames:
+            try:
+                exif_data = get_exif(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            except Exception:
+                continue
+            date = (exif_data.get("DateTimeOriginal") or exif_data.get("DateTime") or '')[:10]
+            if date and (not date_from or date >= date_from) and (not date_to or date <= date_to):
+                selected.append(filename)
+        filenames = selected
+    return filenames
+
+def run_batch_file(job, filename, fields):
+    """Applies a batch's fields to one file and records the per-file result on the job."""
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    try:
+        update_exif(filepath, **fields)
+        result = {"filename": filename, "ok": True}
+    except Exception as e:
+        result = {"filename": filename, "ok": False, "error": str(e)}
+
+    with batch_jobs_lock:
+        job["results"].append(result)
+        job["done"] += 1
+        job["failed"] += not result["ok"]
+        job["finished"] = job["done"] == job["total"]
+    return result
+
+def batch_job_snapshot(job):
+    """Returns a consistent copy of a batch job for JSON serialization."""
+    with batch_jobs_lock:
+        return {**job, "results": list(job["results"])}
+
+@app.route('/batch_exif', methods=['POST'])
+def batch_exif():
+    """
+    Applies the same EXIF changes to many images in one request.
+    Expects JSON with the selection (see select_batch_files) and the fields to set:
+    "latitude"/"longitude" (decimal degrees), "artist" and "copyright".
+    The writes run concurrently on a bounded thread pool. By default the response waits and
+    contains every per-file result; with "wait": false it returns 202 right away, and the
+    job's progress and results can be polled from /batch_exif/<job_id>.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({"error": "Expected a JSON object."}), 400
+    if payload.get("files") is None and not payload.get("glob") and not payload.get("date_from") and not payload.get("date_to"):
+        return jsonify({"error": "Select images with 'files', 'glob' or 'date_from'/'date_to'."}), 400
+    files = payload.get("files")
+    if files is not None and not (isinstance(files, list) and all(isinstance(name, str) for name in files)):
+        return jsonify({"error": "'files' must be a list of filenames."}), 400
+    for key in ("glob", "date_from", "date_to"):
+        if payload.get(key) is not None and not isinstance(payload[key], str):
+            return jsonify({"error": f"'{key}' must be a string."}), 400
+
+    fields = {"artist": payload.get("artist"), "copyright_info": payload.get("copyright")}
+    if payload.get("latitude") not in (None, '') and payload.get("longitude") not in (None, ''):
+        try:
+            fields["latitude"] = float(payload["latitude"])
+            fields["longitude"] = float(payload["longitude"])
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid latitude or longitude format. Please enter numbers."}), 400
+    if "latitude" not in fields and not fields["artist"] and not fields["copyright_info"]:
+        return jsonify({"error": "Nothing to change."}), 400
+
+    try:
+        filenames = select_batch_files(payload)
+    except FileNotFoundError:
+        return jsonify({"error": "Image directory not found"}), 404
+
+    job_id = uuid.uuid4().hex
+    job = {"id": job_id, "total": len(filenames), "done": 0, "failed": 0, "finished": not filenames, "results": []}
+    with batch_jobs_lock:
+        batch_jobs[job_id] = job
+        while len(batch_jobs) > BATCH_JOB_HISTORY:
+            batch_jobs.popitem(last=False)
+
+    futures = [batch_executor.submit(run_batch_file, job, filename, fields) for filename in filenames]
+    if not payload.get("wait", True):
+        return jsonify({"id": job_id, "total": job["total"], "status_url": url_for('batch_exif_status', job_id=job_id)}), 202
+
+    for future in futures:
+        future.result()
+    return jsonify(batch_job_snapshot(job))
+
+@app.route('/batch_exif/<job_id>')
+def batch_exif_status(job_id):
+    """Reports a batch job's progress (done/total/failed) and the per-file results so far."""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown batch job"}), 404
+    return jsonify(batch_job_snapshot(job))
+
 @app.route('/fulls/<filename>')
 def serve_image(filename):
     """
@@ -349,6 +637,144 @@ def serve_image(filename):
     """
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+# --- Cached Previews ---
+
+# Preview bounding boxes; 'card' for the listing, 'preview' for the selected image
+PREVIEW_SIZES = {'card': (400, 300), 'preview': (1200, 900)}
+PREVIEW_QUALITY = 85
+
+# Where generated previews are kept, and how many bytes they may take before the oldest are evicted
+PREVIEW_CACHE_DIR = os.path.join('.cache', 'previews')
+PREVIEW_CACHE_BYTES = 512 * 1024 * 1024
+
+preview_executor = None # Created on first use, decodes are CPU bound so they run in processes
+preview_pending = {} # cache path -> Future, so concurrent requests for one preview share a decode
+preview_cache_bytes = None # Running total of the cache size, scanned from disk on first use
+preview_lock = threading.Lock()
+preview_options = None # The build's default options, resolved on first use
+
+def get_preview_options():
+    """
+    Returns prepareSite's default build options, with the engine the last build picked
+    (from its .cache/engine.json) or Pillow when no build has chosen one yet.
+    """
+    global preview_options
+    if preview_options is None:
+        parser = buildParser()
+        options = buildOptions(parser.parse_args([]), parser)
+        options['engine'] = chooseEngine([], options)
+        preview_options = options
+    return preview_options
+
+def render_preview(src_path, dst_path, size, quality, options):
+    """
+    Worker: decodes an image (at reduced JPEG scale when possible) and writes a preview no larger than size,
+    through the same decode, resize and encode backends as the gallery build.
+    Written to a temporary file and renamed so a half-written preview is never served. Returns the byte size.
+    """
+    with open(src_path, 'rb') as f:
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as img:
+        base = backend(options, 'decode')(img, data, [size], options)
+    preview = backend(options, 'resize')(base, size, options['filter'])
+    encoded = backend(options, 'encode')(preview, quality, options['optimize'], options['progressive'])
+    tmp_path = f'{dst_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(encoded)
+    os.replace(tmp_path, dst_path)
+    return len(encoded)
+
+def trim_preview_cache(added_bytes):
+    """
+    Adds a new preview to the running cache size and, once over PREVIEW_CACHE_BYTES,
+    deletes the least recently used previews (by mtime, which is refreshed on every hit).
+    """
+    global preview_cache_bytes
+    with preview_lock:
+        if preview_cache_bytes is None:
+            preview_cache_bytes = sum(entry.stat().st_size for folder in os.scandir(PREVIEW_CACHE_DIR) if folder.is_dir()
+                                      for entry in os.scandir(folder.path) if entry.is_file())
+        else:
+            preview_cache_bytes += added_bytes
+        if preview_cache_bytes <= PREVIEW_CACHE_BYTES:
+            return
+
+        entries = sorted((entry.stat().st_mtime_ns, entry.stat().st_size, entry.path)
+                         for folder in os.scandir(PREVIEW_CACHE_DIR) if folder.is_dir()
+                         for entry in os.scandir(folder.path) if entry.is_file() and entry.name.endswith('.jpg'))
+        preview_cache_bytes = sum(size for _, size, _ in entries)
+        target = PREVIEW_CACHE_BYTES * 0.9 # Leave some headroom so we don't trim on every request
+        for _, size, path in entries:
+            if preview_cache_bytes <= target:
+                break
+            try:
+                os.remove(path)
+                preview_cache_bytes -= size
+            except OSError: # Already gone, or still open on Windows
+                pass
+
+def get_preview(filepath, size_name):
+    """
+    Returns the path of a cached preview of an image, generating it on the preview worker pool if needed,
+    along with the bytes it added to the cache (0 on a hit, or when another request generated it).
+    Previews are keyed by path, mtime and size, so a modified original gets a fresh preview.
+    """
+    global preview_executor
+    stat = os.stat(filepath)
+    key = hashlib.sha1(f'{os.path.abspath(filepath)}:{stat.st_mtime_ns}:{stat.st_size}'.encode('utf-8')).hexdigest()
+    cache_path = os.path.join(PREVIEW_CACHE_DIR, size_name, f'{key}.jpg')
+    if os.path.exists(cache_path):
+        os.utime(cache_path) # Mark as recently used for eviction
+        return cache_path, 0
+
+    with preview_lock:
+        future = preview_pending.get(cache_path)
+        if future is None:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            if preview_executor is None:
+                preview_executor = ProcessPoolExecutor(max_workers=cpu_count())
+            future = preview_executor.submit(render_preview, filepath, cache_path, PREVIEW_SIZES[size_name], PREVIEW_QUALITY, get_preview_options())
+            preview_pending[cache_path] = future
+    try:
+        added_bytes = future.result()
+    finally:
+        with preview_lock:
+            # Only the first waiter to get here removes the entry and accounts for the new file
+            owner = preview_pending.pop(cache_path, None) is future
+    return cache_path, added_bytes if owner else 0
+
+@app.route('/preview/<size_name>/<filename>')
+def serve_preview(size_name, filename):
+    """
+    Serves a downscaled preview of an image instead of the multi-megabyte original.
+    Previews are generated on first request and kept in a size-bounded disk cache. The page adds
+    the file's mtime as ?v=, so the response can be cached by the browser for a year.
+    """
+    if size_name not in PREVIEW_SIZES:
+        return "Unknown preview size.", 404
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if os.path.basename(filename) != filename or not filename.lower().endswith(IMAGE_EXTENSIONS) or not os.path.isfile(filepath):
+        return "File not found.", 404
+
+    try:
+        try:
+            cache_path, added_bytes = get_preview(filepath, size_name)
+            # Open before trimming, so evicting this very preview can't pull it from under the response
+            preview_file = open(cache_path, 'rb')
+        except FileNotFoundError:
+            # Evicted by a concurrent request between generating and opening it, generate it again
+            cache_path, added_bytes = get_preview(filepath, size_name)
+            preview_file = open(cache_path, 'rb')
+    except Exception as e:
+        print(f"Error creating preview for {filename}: {e}")
+        return serve_image(filename) # Fall back to the original, the browser may still be able to show it
+    if added_bytes:
+        trim_preview_cache(added_bytes)
+
+    response = send_file(preview_file, mimetype='image/jpeg', max_age=365 * 24 * 3600)
+    response.headers['Cache-Control'] += ', immutable'
+    return response
+
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
     """
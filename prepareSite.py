@@ -1,25 +1,209 @@
 import os
 import io
-import base64
 import numpy as np
 import cv2 as cv
 import json
 from tqdm import tqdm
 import exifread
+import piexif
 import shutil
-from datetime import datetime
-from PIL import Image, ImageOps
+from datetime import datetime, timedelta
+from PIL import Image, ImageOps, features
 from PIL.ExifTags import TAGS
 import time
+import math
+import mmap
+import struct
+import itertools
+import functools
+import hashlib
+import threading
+import contextlib
+import queue
+import sqlite3
+import tempfile
+from array import array
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Pool, cpu_count
 import argparse
 
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # Optional: --watch falls back to polling
+    Observer = None
+
 fullDir = './fulls'
 thumbDir = './thumbs'
+variantDir = './sizes'
+atlasDir = './atlas'
+tileDir = './tiles'
 metadataDir = './metadata'
 metadataJSON = './metadata/metadata.json'
+indexJSON = './metadata/index.json'
+columnsJSON = './metadata/columns.json'
+geoJSON = './metadata/geo.json'
+geoDir = './metadata/geo'
+facetsJSON = './metadata/facets.json'
+atlasJSON = './metadata/atlas.json'
+shardDir = './metadata/shards'
+cacheDir = './.cache'
+manifestJSON = './.cache/manifest.json'
+journalPath = './.cache/results.jsonl'
+recordsDB = './.cache/records.sqlite'
+engineJSON = './.cache/engine.json'
+MANIFEST_VERSION = 3
+VARIANT_FORMATS = {'avif': 'AVIF', 'webp': 'WEBP', 'jpg': 'JPEG'}
 
 imgNames = []
+_pool = None  # One worker pool for every stage of a build (and across rebuilds in --watch mode)
+_poolSettings = {'jobs': cpu_count(), 'maxtasksperchild': None}
+_spans = None  # Trace events recorded by this process while --trace is on
+
+def writeText(path, text):
+    # Write to a temp file and rename so readers never see a half-written file
+    tmpPath = f'{path}.tmp'
+    with open(tmpPath, 'w') as f:
+        f.write(text)
+    os.replace(tmpPath, path)
+
+def writeJSON(path, data, **kwargs):
+    writeText(path, json.dumps(data, **kwargs))
+
+def hashFile(filePath):
+    h = hashlib.blake2b(digest_size=16)
+    with open(filePath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def loadManifest(params):
+    empty = {'version': MANIFEST_VERSION, 'params': params, 'images': {}}
+    if not os.path.exists(manifestJSON):
+        return empty
+    try:
+        with open(manifestJSON, 'r') as f:
+            manifest = json.load(f)
+    except (json.JSONDecodeError, OSError):
+        print(f"Warning: Could not read {manifestJSON}. Rebuilding everything.")
+        return empty
+    # Output settings changed (or old format): every derived file is stale
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('params') != params:
+        return empty
+    return manifest
+
+def saveManifest(manifest):
+    if not os.path.exists(cacheDir): os.mkdir(cacheDir)
+    writeJSON(manifestJSON, manifest)
+
+def openJournal(params):
+    # Results are appended as they complete, so a crashed or killed build resumes from here
+    # instead of redoing every image. The first line records the settings they were made with.
+    if not os.path.exists(cacheDir): os.mkdir(cacheDir)
+    if os.path.exists(journalPath):
+        journal = open(journalPath, 'a+')
+        journal.seek(0, os.SEEK_END)
+        if journal.tell() > 0:
+            journal.seek(journal.tell() - 1)
+            if journal.read(1) != '\n':
+                journal.write('\n')  # Terminate a record torn by the crash
+        return journal
+    journal = open(journalPath, 'w')
+    journal.write(json.dumps({'version': MANIFEST_VERSION, 'params': params}) + '\n')
+    journal.flush()
+    return journal
+
+def replayJournal(manifest, all_metadata, params):
+    # Returns the names whose results were recovered: they are no longer stale, but anything
+    # derived from them after processing (the atlas) still has to be redone
+    if not os.path.exists(journalPath):
+        return []
+    replayed = []
+    with open(journalPath, 'r') as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            header = None
+        if not header or header.get('version') != MANIFEST_VERSION or header.get('params') != params:
+            f.close()
+            os.remove(journalPath)  # Made with other settings, those results are stale anyway
+            return []
+        for line in f:
+            try:
+                name, sort_key, meta, entry = json.loads(line)
+            except ValueError:
+                continue  # Torn record from the crash
+            all_metadata[name] = meta
+            if entry:
+                manifest['images'][name] = entry
+            else:
+                manifest['images'].pop(name, None)
+            replayed.append(name)
+    return replayed
+
+def getStaleImages(manifest, all_metadata, useHash=False, widths=(), names=None):
+    # An image is stale when its size/mtime changed (unless --hash proves the bytes are
+    # identical) or when one of its outputs has gone missing. With names (from --watch),
+    # only those images are checked and the others are known to be unchanged.
+    stale = []
+    vanished = []
+    variantFiles = set(os.listdir(variantDir)) if widths and os.path.exists(variantDir) else set()
+    for name in (imgNames if names is None else [name for name in imgNames if name in names]):
+        fullPath = f'{fullDir}/{name}.jpg'
+        try:
+            st = os.stat(fullPath)
+        except OSError:
+            vanished.append(name)  # Deleted or renamed since the listing
+            continue
+        entry = manifest['images'].get(name)
+        meta = all_metadata.get(name)
+        if not entry or not meta or 'blurhash' not in meta or (widths and 'variants' not in meta) \
+                or (widths and any(f'{name}-{w}.{fmt}' not in variantFiles for fmt, ws in meta['variants'].items() for w in ws)) \
+                or not os.path.exists(f'{thumbDir}/{name}.jpg') \
+                or ('tiles' in meta and not os.path.exists(f'{tileDir}/{name}.dzi')):
+            stale.append(name)
+            continue
+        if entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+            continue
+        if useHash and entry.get('hash') and entry['size'] == st.st_size:
+            if hashFile(fullPath) == entry['hash']:
+                entry['mtime'] = st.st_mtime_ns
+                continue
+        stale.append(name)
+    for name in vanished:
+        imgNames.remove(name)  # pruneDeleted then cleans up after them
+    return stale
+
+def removeTiles(name):
+    if os.path.exists(f'{tileDir}/{name}.dzi'):
+        os.remove(f'{tileDir}/{name}.dzi')
+    shutil.rmtree(f'{tileDir}/{name}_files', ignore_errors=True)
+
+def pruneDeleted(manifest, all_metadata, widths=(), formats=()):
+    current = set(imgNames)
+    removed = 0
+    if os.path.exists(tileDir):
+        for file in os.listdir(tileDir):
+            if file.endswith('.dzi') and file[:-4] not in current:
+                removeTiles(file[:-4])
+    for file in os.listdir(thumbDir):
+        name, ext = os.path.splitext(file)
+        if ext == '.jpg' and name not in current:
+            os.remove(os.path.join(thumbDir, file))
+            removed += 1
+    # Variants of deleted images, or left over from a different --widths/--formats
+    if os.path.exists(variantDir):
+        for file in os.listdir(variantDir):
+            stem, ext = os.path.splitext(file)
+            name, _, width = stem.rpartition('-')
+            if name not in current or not width.isdigit() or int(width) not in widths or ext[1:] not in formats:
+                os.remove(os.path.join(variantDir, file))
+    for name in [k for k in all_metadata if k != 'image_order' and k not in current]:
+        del all_metadata[name]
+    for name in [k for k in manifest['images'] if k not in current]:
+        del manifest['images'][name]
+    return removed
 
 def _convert_to_degrees(value):
     d = float(value.values[0].numerator) / value.values[0].denominator
@@ -44,154 +228,1285 @@ def get_gps_coordinates(tags):
         return latitude, longitude
     return None
 
-def process_thumbnail(args):
-    name, quality, size = args
-    thumbPath = f'./{thumbDir}/{name}.jpg'
-    fullPath = f'{fullDir}/{name}.jpg'
+def get_sort_key(tags, mtime):
+    # Date Taken, falling back to the file's modification time
+    if 'EXIF DateTimeOriginal' in tags:
+        try:
+            return datetime.strptime(str(tags['EXIF DateTimeOriginal']), "%Y:%m:%d %H:%M:%S").timestamp()
+        except ValueError: pass
+    return mtime
 
-    if os.path.exists(thumbPath):
-        return # Skip if exists (or we could add a force flag)
+def read_exif_header(f):
+    # Walk the JPEG marker segments and return just SOI + the APP1/Exif segment,
+    # so a date lookup reads a few KB instead of streaming the whole file
+    if f.read(2) != b'\xff\xd8':
+        return None
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        while marker[1] == 0xFF:  # Fill bytes
+            marker = marker[1:] + f.read(1)
+        if marker[1] in (0xD9, 0xDA):  # EOI / start of scan: no Exif before the image data
+            return None
+        if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD7:
+            continue  # Standalone markers carry no length
+        length = struct.unpack('>H', f.read(2))[0]
+        if marker[1] == 0xE1:
+            payload = f.read(length - 2)
+            if payload.startswith(b'Exif\x00\x00'):
+                return b'\xff\xd8\xff\xe1' + struct.pack('>H', length) + payload
+        else:
+            f.seek(length - 2, 1)
 
+def scan_sort_key(name):
+    fullPath = f'{fullDir}/{name}.jpg'
     try:
-        from PIL import ImageOps
-        with Image.open(fullPath) as img_pil:
-            img_pil = ImageOps.exif_transpose(img_pil)  # Apply EXIF rotation
-            if img_pil.mode != 'RGB':
-                img_pil = img_pil.convert('RGB')
-            img_pil.thumbnail(size, Image.LANCZOS)  # Preserves aspect ratio
-            img_pil.save(thumbPath, 'JPEG', quality=int(max(1, min(quality, 100))), optimize=True, progressive=True)
-    except Exception as e:
-        print(f"Warning: Could not process {fullPath}: {e}")
+        with open(fullPath, 'rb') as f:
+            mtime = os.fstat(f.fileno()).st_mtime
+            header = read_exif_header(f)
+        tags = exifread.process_file(io.BytesIO(header + b'\xff\xd9'), stop_tag='DateTimeOriginal', details=False) if header else {}
+    except Exception:
+        try:
+            return (name, os.path.getmtime(fullPath))
+        except OSError:
+            return (name, 0)  # Deleted since the listing: sorted first, pruned by the next build
+    return (name, get_sort_key(tags, mtime))
 
-def getThumbs(quality=85, check=False, size=(1200, 900)):
-    # Prepare arguments for multiprocessing
-    tasks = []
-    for name in imgNames:
-        thumbPath = f'./{thumbDir}/{name}.jpg'
-        if not check or not os.path.exists(thumbPath):
-            tasks.append((name, quality, size))
-    
-    if not tasks:
-        return
+def scanSortKeys(names):
+    if not names:
+        return {}
+    return dict(tqdm(getPool().imap_unordered(scan_sort_key, names, chunksize=16), total=len(names), desc="Scanning Dates"))
 
-    # Use multiprocessing
-    with Pool(cpu_count()) as pool:
-        list(tqdm(pool.imap_unordered(process_thumbnail, tasks), total=len(tasks), desc="Making Thumbnails"))
+def _text(tag):
+    return str(tag).strip()
 
-def getFileSize(filePath):
-    return os.stat(filePath).st_size
+def _number(tag):
+    value = float(tag.values[0] if isinstance(tag.values, list) else tag.values)
+    return int(value) if value.is_integer() else round(value, 6)
 
-def process_metadata(name):
-    fullPath = f'{fullDir}/{name}.jpg'
+def _integer(tag):
+    return int(tag.values[0] if isinstance(tag.values, list) else tag.values)
+
+def _timestamp(tag):
+    return datetime.strptime(str(tag).strip(), "%Y:%m:%d %H:%M:%S").isoformat()
+
+# exifread tag name -> converter. Anything not listed here is dropped unless asked for with --fields
+METADATA_SCHEMA = {
+    'Image Make': _text,
+    'Image Model': _text,
+    'EXIF LensModel': _text,
+    'Image Artist': _text,
+    'Image Copyright': _text,
+    'Image DateTime': _timestamp,
+    'EXIF DateTimeOriginal': _timestamp,
+    'EXIF ExposureTime': _number,
+    'EXIF FNumber': _number,
+    'EXIF FocalLength': _number,
+    'EXIF FocalLengthIn35mmFilm': _integer,
+    'EXIF ISOSpeedRatings': _integer,
+    'EXIF ExposureBiasValue': _number,
+    'EXIF ExposureProgram': _text,
+    'EXIF MeteringMode': _text,
+    'EXIF Flash': _text,
+    'EXIF WhiteBalance': _text,
+}
+GPS_FIELDS = ('GPS Latitude', 'GPS Longitude')  # Decimal degrees, derived from the GPS IFD
+DEFAULT_FIELDS = list(METADATA_SCHEMA) + list(GPS_FIELDS)
+
+def extract_metadata(tags, fields=DEFAULT_FIELDS):
     metadata = {}
-    
-    try:
-        with open(fullPath, 'rb') as full_file:
-            tags = exifread.process_file(full_file)
-        
+    if fields is None:
+        # --fields all: every tag as exifread prints it
         for tag in tags.keys():
-            if tag not in ('JPEGThumbnail', 'TIFFThumbnail'):
+            if tag not in ('JPEGThumbnail', 'TIFFThumbnail', 'EXIF MakerNote'):
                 metadata[tag] = str(tags[tag])
+        fields = GPS_FIELDS
+
+    for field in fields:
+        if field in tags:
+            try:
+                metadata[field] = METADATA_SCHEMA.get(field, _text)(tags[field])
+            except (ValueError, TypeError, IndexError, ZeroDivisionError):
+                pass  # Malformed value: leave the field out rather than store junk
 
-        # Get width and height from PIL.Image
+    if any(field in GPS_FIELDS for field in fields):
         try:
-            with Image.open(fullPath) as img_pil:
-                metadata['Image Width'] = img_pil.width
-                metadata['Image Height'] = img_pil.height
-        except Exception as e:
-            # print(f"Warning: Could not get dimensions for {name}.jpg: {e}")
-            metadata['Image Width'] = metadata.get('Image Width', 'N/A')
-            metadata['Image Height'] = metadata.get('Image Height', 'N/A')
+            gps = get_gps_coordinates(tags)
+        except (AttributeError, IndexError, ZeroDivisionError):
+            gps = None
+        if gps:
+            metadata['GPS Latitude'] = round(gps[0], 6)
+            metadata['GPS Longitude'] = round(gps[1], 6)
+    return metadata
+
+def draft_size(img_pil, boxes, maxScale=8, oversample=2.0):
+    # Smallest decode size that still leaves `oversample` x the largest output box for the
+    # resampling pass to work with, or None when a scaled decode doesn't apply
+    if img_pil.format != 'JPEG' or maxScale <= 1:
+        return None
+    w, h = img_pil.size
+    orientation = img_pil.getexif().get(0x0112, 1)
+    need = [math.ceil(w / maxScale), math.ceil(h / maxScale)]
+    for box in boxes:
+        if orientation >= 5:
+            box = box[::-1]  # 5-8 are rotated by exif_transpose
+        r = min(box[0] / w, box[1] / h, 1.0)
+        need = [max(need[0], math.ceil(w * r * oversample)), max(need[1], math.ceil(h * r * oversample))]
+    return tuple(need)
+
+def draft_decode(img_pil, boxes, maxScale=8, oversample=2.0):
+    # Let libjpeg decode at 1/2, 1/4 or 1/8 scale (scaled IDCT), but never below
+    # `oversample` x the largest output box so the LANCZOS pass still has detail to work with
+    need = draft_size(img_pil, boxes, maxScale, oversample)
+    if need:
+        img_pil.draft('RGB', need)
+
+def normalize_image(img_pil):
+    img_pil = ImageOps.exif_transpose(img_pil)  # Apply EXIF rotation
+    if img_pil.mode != 'RGB':
+        img_pil = img_pil.convert('RGB')
+    return img_pil
+
+# --- Decode, resize and encode backends ---
+# Every stage has a Pillow and an OpenCV implementation. Images are handed between stages as
+# RGB PIL images, so the engines can be mixed and everything downstream is unaffected.
+
+RESIZE_FILTERS = {'lanczos': (Image.LANCZOS, cv.INTER_LANCZOS4), 'area': (Image.BOX, cv.INTER_AREA)}
+CV_REDUCED = {1: cv.IMREAD_COLOR, 2: cv.IMREAD_REDUCED_COLOR_2, 4: cv.IMREAD_REDUCED_COLOR_4, 8: cv.IMREAD_REDUCED_COLOR_8}
+
+def thumb_size(size, box):
+    w, h = size
+    r = min(box[0] / w, box[1] / h, 1.0)
+    return (max(1, round(w * r)), max(1, round(h * r)))
+
+def decode_pil(img_pil, data, boxes, options):
+    draft_decode(img_pil, boxes, options['draft'], options['oversample'])
+    return normalize_image(img_pil)
+
+def decode_cv(img_pil, data, boxes, options):
+    # Same scale as Pillow's draft: the largest 1/2^k that still covers the needed size.
+    # OpenCV applies the EXIF orientation itself.
+    need = draft_size(img_pil, boxes, options['draft'], options['oversample'])
+    scale = 1
+    if need:
+        w, h = img_pil.size
+        while scale < 8 and math.ceil(w / (scale * 2)) >= need[0] and math.ceil(h / (scale * 2)) >= need[1]:
+            scale *= 2
+    pixels = cv.imdecode(np.frombuffer(data, np.uint8), CV_REDUCED[scale])
+    if pixels is None:
+        raise ValueError('OpenCV could not decode the image')
+    return Image.fromarray(cv.cvtColor(pixels, cv.COLOR_BGR2RGB))
+
+def resize_pil(img, size, filter):
+    return img.resize(thumb_size(img.size, size), RESIZE_FILTERS[filter][0], reducing_gap=2.0)  # As Image.thumbnail
+
+def resize_cv(img, size, filter):
+    return Image.fromarray(cv.resize(np.asarray(img), thumb_size(img.size, size), interpolation=RESIZE_FILTERS[filter][1]))
+
+def encode_pil(img, quality, optimize, progressive):
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=quality, optimize=optimize, progressive=progressive)
+    return buf.getvalue()
 
-        # GPS
-        if tags.get('GPS GPSLatitude') and tags.get('GPS GPSLongitude'):
-            metadata['GPS GPSLatitude'] = str(tags['GPS GPSLatitude'])
-            metadata['GPS GPSLatitudeRef'] = str(tags['GPS GPSLatitudeRef'])
-            metadata['GPS GPSLongitude'] = str(tags['GPS GPSLongitude'])
-            metadata['GPS GPSLongitudeRef'] = str(tags['GPS GPSLongitudeRef'])
+def encode_cv(img, quality, optimize, progressive):
+    ok, buf = cv.imencode('.jpg', cv.cvtColor(np.asarray(img), cv.COLOR_RGB2BGR),
+                          [cv.IMWRITE_JPEG_QUALITY, quality, cv.IMWRITE_JPEG_OPTIMIZE, int(optimize), cv.IMWRITE_JPEG_PROGRESSIVE, int(progressive)])
+    if not ok:
+        raise ValueError('OpenCV could not encode the image')
+    return buf.tobytes()
 
-        metadata['File Size'] = getFileSize(fullPath)
+BACKENDS = {
+    'pil': {'decode': decode_pil, 'resize': resize_pil, 'encode': encode_pil},
+    'cv': {'decode': decode_cv, 'resize': resize_cv, 'encode': encode_cv},
+}
+ENGINE_STAGES = ('decode', 'resize', 'encode')
 
-        # Generate LQIP from thumbnail (thumbnails are generated before metadata)
-        thumbPath = f'{thumbDir}/{name}.jpg'
+def backend(options, stage):
+    return BACKENDS[options['engine'][stage]][stage]
+
+def psnr(a, b):
+    a, b = np.asarray(a, np.float32), np.asarray(b, np.float32)
+    if a.shape != b.shape:
+        return 0.0
+    mse = np.mean((a - b) ** 2)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+def benchmarkEngines(names, options, samples=3, repeat=3):
+    # Time every backend per stage on the first `samples` images that decode; quality is the PSNR
+    # against the Pillow path (decode and resize) or against the encoder's input (encode)
+    timings = {stage: {engine: [] for engine in BACKENDS} for stage in ENGINE_STAGES}
+    quality = {stage: {engine: [] for engine in BACKENDS} for stage in ENGINE_STAGES}
+    q = int(max(1, min(options['quality'], 100)))
+
+    def timed(fn, *args):
+        best, result = math.inf, None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            result = fn(*args)
+            best = min(best, time.perf_counter() - t0)
+        return best, result
+
+    def measure(data):
+        seconds, scores, decoded = {}, {}, {}
+        for engine, fns in BACKENDS.items():
+            def decode():
+                with Image.open(io.BytesIO(data)) as img_pil:
+                    return fns['decode'](img_pil, data, [options['size']], options)
+            seconds['decode', engine], decoded[engine] = timed(decode)
+        reference = resize_pil(decoded['pil'], options['size'], options['filter'])
+        for engine, fns in BACKENDS.items():
+            scores['decode', engine] = psnr(resize_pil(decoded[engine], options['size'], options['filter']), reference)
+            seconds['resize', engine], thumb = timed(fns['resize'], decoded['pil'], options['size'], options['filter'])
+            scores['resize', engine] = psnr(thumb, reference)
+            seconds['encode', engine], encoded = timed(fns['encode'], reference, q, options['optimize'], options['progressive'])
+            with Image.open(io.BytesIO(encoded)) as roundTrip:
+                scores['encode', engine] = psnr(roundTrip.convert('RGB'), reference)
+        return seconds, scores
+
+    measured = 0
+    for name in names:
+        if measured == samples:
+            break
         try:
-            with Image.open(thumbPath) as thumb_img:
-                lqip = thumb_img.copy()
-                lqip.thumbnail((20, 20), Image.LANCZOS)
-                buf = io.BytesIO()
-                lqip.save(buf, format='JPEG', quality=20, optimize=True)
-                metadata['lqip'] = 'data:image/jpeg;base64,' + base64.b64encode(buf.getvalue()).decode()
+            with open(f'{fullDir}/{name}.jpg', 'rb') as f:
+                seconds, scores = measure(f.read())
         except Exception:
-            pass  # LQIP is optional — graceful degradation
+            continue  # Damaged or vanished file: process_image will report it, try the next one
+        for stage, engine in seconds:
+            timings[stage][engine].append(seconds[stage, engine])
+            quality[stage][engine].append(scores[stage, engine])
+        measured += 1
+    if not measured:
+        return None, None
+    return ({stage: {engine: sum(t) / measured for engine, t in engines.items()} for stage, engines in timings.items()},
+            {stage: {engine: min(p) for engine, p in engines.items()} for stage, engines in quality.items()})
+
+def chooseEngine(names, options, minPSNR=35.0):
+    # Fastest backend per stage among those within the quality threshold, cached in .cache
+    # until the libraries or the thumbnail settings change
+    key = {'pillow': Image.__version__, 'opencv': cv.__version__, 'cpus': cpu_count(), 'min_psnr': minPSNR,
+           **{k: list(v) if isinstance(v, tuple) else v for k, v in options.items() if k in ('size', 'quality', 'draft', 'oversample', 'filter', 'optimize', 'progressive')}}
+    if os.path.exists(engineJSON):
+        try:
+            with open(engineJSON, 'r') as f:
+                cached = json.load(f)
+            if cached.get('key') == key:
+                return cached['engine']
+        except json.JSONDecodeError:
+            pass
+    timings, quality = benchmarkEngines(names, options)
+    if timings is None:
+        return {stage: 'pil' for stage in ENGINE_STAGES}  # Nothing decodable to measure on: don't cache
+    engine = {}
+    for stage in ENGINE_STAGES:
+        candidates = [e for e in BACKENDS if quality[stage][e] >= minPSNR] or ['pil']
+        engine[stage] = min(candidates, key=lambda e: timings[stage][e])
+        print(f"Engine {stage}: {engine[stage]} (" + ', '.join(
+            f"{e} {timings[stage][e] * 1000:.1f} ms, {quality[stage][e]:.1f} dB" for e in BACKENDS) + ')')
+    if not os.path.exists(cacheDir): os.mkdir(cacheDir)
+    writeJSON(engineJSON, {'key': key, 'engine': engine, 'timings': timings}, indent=4)
+    return engine
+
+_encodePool = None
+
+def save_variant(img, path, fmt, quality):
+    # Renamed into place, so an interrupted build never leaves a truncated variant that looks done
+    tmpPath = f'{path}.tmp'
+    if fmt == 'jpg':
+        img.save(tmpPath, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        img.save(tmpPath, VARIANT_FORMATS[fmt], quality=quality)
+    os.replace(tmpPath, path)
+
+def make_variants(base, name, widths, formats, quality):
+    # Resize largest-first (each step resamples the previous one) and encode every
+    # width/format pair on a thread pool; Pillow releases the GIL while encoding
+    global _encodePool
+    if _encodePool is None:
+        _encodePool = ThreadPoolExecutor(max_workers=max(2, len(formats)))
+    img = base
+    made = []
+    futures = []
+    for w in sorted(widths, reverse=True):
+        if w >= base.width:
+            continue  # Never upscale; the viewer falls back to the full
+        img = img.resize((w, max(1, round(base.height * w / base.width))), Image.LANCZOS)
+        made.append(w)
+        for fmt in formats:
+            futures.append(_encodePool.submit(save_variant, img, f'{variantDir}/{name}-{w}.{fmt}', fmt, quality))
+    for future in futures:
+        future.result()
+    return {fmt: sorted(made) for fmt in formats}
 
-        return (name, metadata)
+TILE_SIZE = 254  # Deep Zoom defaults: 254px tiles plus 1px overlap make 256px images
+TILE_OVERLAP = 1
+TILE_MIN_SIZE = 3000  # Smaller images are served whole, tiling them gains nothing
+
+def make_tiles(base, name, quality, tileSize=TILE_SIZE, overlap=TILE_OVERLAP):
+    # Deep Zoom (DZI) pyramid: level L is the image scaled by 2^(L - maxLevel), cut into
+    # tileSize tiles with `overlap` extra pixels on inner edges, at tiles/<name>_files/L/col_row.jpg.
+    # Written next to the old pyramid and swapped in, so a viewer never sees a half-built one.
+    global _encodePool
+    if _encodePool is None:
+        _encodePool = ThreadPoolExecutor(max_workers=2)
+    filesDir = f'{tileDir}/{name}_files'
+    tmpDir = f'{filesDir}.tmp'
+    shutil.rmtree(tmpDir, ignore_errors=True)
+    width, height = base.size
+    maxLevel = math.ceil(math.log2(max(width, height)))
+    img = base
+    futures = []
+    for level in range(maxLevel, -1, -1):
+        levelDir = f'{tmpDir}/{level}'
+        os.makedirs(levelDir)
+        w, h = img.size
+        for col in range(math.ceil(w / tileSize)):
+            for row in range(math.ceil(h / tileSize)):
+                x0 = max(0, col * tileSize - overlap)
+                y0 = max(0, row * tileSize - overlap)
+                x1 = min(w, (col + 1) * tileSize + overlap)
+                y1 = min(h, (row + 1) * tileSize + overlap)
+                futures.append(_encodePool.submit(img.crop((x0, y0, x1, y1)).save, f'{levelDir}/{col}_{row}.jpg', 'JPEG', quality=quality))
+        if level:
+            img = img.resize((math.ceil(w / 2), math.ceil(h / 2)), Image.BOX)  # Exact 2x box filter
+    for future in futures:
+        future.result()
+
+    shutil.rmtree(filesDir, ignore_errors=True)
+    os.replace(tmpDir, filesDir)
+    writeText(f'{tileDir}/{name}.dzi',
+              '<?xml version="1.0" encoding="UTF-8"?>\n'
+              f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="jpg" Overlap="{overlap}" TileSize="{tileSize}">'
+              f'<Size Width="{width}" Height="{height}"/></Image>\n')
+    return [width, height]
+
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+SRGB_TO_LINEAR = np.where(np.arange(256) / 255 <= 0.04045, np.arange(256) / 255 / 12.92,
+                          ((np.arange(256) / 255 + 0.055) / 1.055) ** 2.4)
+
+def encode83(value, length):
+    return ''.join(BASE83[value // 83 ** (length - i - 1) % 83] for i in range(length))
+
+def linear_to_srgb(v):
+    v = np.clip(v, 0, 1)
+    return np.where(v <= 0.0031308, v * 12.92 * 255 + 0.5, (1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5).astype(int)
+
+@functools.lru_cache(maxsize=64)
+def cosineBasis(n, size):
+    # Thumbnails share a handful of sizes, so the basis is computed once per worker
+    return np.cos(np.pi * np.arange(n)[:, None] * np.arange(size)[None, :] / size)  # n x size
+
+def make_blurhash(thumb, components=None):
+    # BlurHash (https://blurha.sh): a few DCT coefficients of the image in linear light, ~28
+    # characters instead of a ~600 character base64 JPEG. The first (DC) term is the mean colour.
+    if thumb.mode != 'RGB':
+        thumb = thumb.convert('RGB')
+    small = thumb.reduce(max(1, math.ceil(max(thumb.size) / 32)))  # Box average down to ~32px
+    pixels = SRGB_TO_LINEAR[np.asarray(small)]  # h x w x 3
+    h, w = pixels.shape[:2]
+    nx, ny = components or ((4, 3) if w >= h else (3, 4))
+    basisX, basisY = cosineBasis(nx, w), cosineBasis(ny, h)
+    rows = (basisY @ pixels.reshape(h, -1)).reshape(ny, w, 3)  # Separable: rows first, then columns
+    factors = np.einsum('ix,jxc->jic', basisX, rows).reshape(-1, 3) / (w * h)
+    factors[1:] *= 2
+    dc, ac = factors[0], factors[1:]
+
+    blurhash = encode83((nx - 1) + (ny - 1) * 9, 1)
+    if len(ac):
+        quantisedMax = int(max(0, min(82, math.floor(np.abs(ac).max() * 166 - 0.5))))
+        maxValue = (quantisedMax + 1) / 166
+    else:
+        quantisedMax, maxValue = 0, 1
+    blurhash += encode83(quantisedMax, 1)
+    r, g, b = linear_to_srgb(dc)
+    blurhash += encode83((int(r) << 16) + (int(g) << 8) + int(b), 4)
+    q = np.clip(np.floor(np.sign(ac) * np.sqrt(np.abs(ac / maxValue)) * 9 + 9.5), 0, 18).astype(int)
+    for qr, qg, qb in q:
+        blurhash += encode83(int(qr) * 361 + int(qg) * 19 + int(qb), 2)
+    return blurhash
+
+@contextlib.contextmanager
+def span(stage, **args):
+    # Times the block as a Chrome trace 'complete' event when tracing, otherwise costs nothing.
+    # The yielded dict becomes the event's args, so the block can add e.g. byte counts.
+    if _spans is None:
+        yield args
+        return
+    t0 = time.perf_counter_ns()  # Monotonic system-wide clock, comparable across the workers
+    try:
+        yield args
+    finally:
+        _spans.append({'name': stage, 'ph': 'X', 'ts': t0 / 1000, 'dur': (time.perf_counter_ns() - t0) / 1000,
+                       'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args})
+
+def process_image(args):
+    # One read and one decode per image: sort key, thumbnail, dimensions,
+    # metadata record and placeholder are all produced from the same bytes
+    name, options = args
+    fullPath = f'{fullDir}/{name}.jpg'
+
+    try:
+        # Mapped rather than read, so the bytes (usually already in the page cache thanks to
+        # the prefetcher) are parsed and decoded in place without a private copy
+        with span('read') as info, open(fullPath, 'rb') as full_file:
+            st = os.fstat(full_file.fileno())
+            data = mmap.mmap(full_file.fileno(), 0, access=mmap.ACCESS_READ)
+            info['bytes_in'] = st.st_size
+            if _spans is not None:
+                # Fault every page in now, so the trace charges storage time to 'read' instead
+                # of spreading it over whichever of 'exif' and 'decode' first touches the page
+                if hasattr(mmap, 'MADV_WILLNEED'):
+                    data.madvise(mmap.MADV_WILLNEED)
+                info['pages'] = len(data[::mmap.PAGESIZE])
+    except (OSError, ValueError) as e:  # ValueError: empty file, which can't be mapped
+        return (name, None, {"Error": str(e)}, None)
+    with data:
+        return process_image_data(name, options, data, st)
+
+def process_image_data(name, options, data, st):
+    size = options['size']
+    widths = options['widths']
+    quality = int(max(1, min(options['quality'], 100)))
+    fullPath = f'{fullDir}/{name}.jpg'
+    thumbPath = f'{thumbDir}/{name}.jpg'
+
+    entry = {'size': st.st_size, 'mtime': st.st_mtime_ns}
+    if options['hash']:
+        entry['hash'] = hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    try:
+        with span('exif'):
+            data.seek(0)
+            tags = exifread.process_file(data, details=options['fields'] is None)
+    except Exception:
+        tags = {}
+    entry['sort_key'] = get_sort_key(tags, st.st_mtime)
+
+    try:
+        metadata = extract_metadata(tags, options['fields'])
+        metadata['File Size'] = len(data)
+
+        data.seek(0)
+        with span('decode') as info, Image.open(data) as img_pil:
+            metadata['Image Width'] = img_pil.width
+            metadata['Image Height'] = img_pil.height
+            tiled = options['tiles'] and max(img_pil.size) >= TILE_MIN_SIZE
+            boxes = [size] + ([(max(widths), math.inf)] if widths else []) + ([(math.inf, math.inf)] if tiled else [])
+            base = backend(options, 'decode')(img_pil, data, boxes, options)
+            info['size'] = list(base.size)
+        with span('resize'):
+            thumb = backend(options, 'resize')(base, size, options['filter'])  # Preserves aspect ratio
+        with span('encode') as info:
+            encoded = backend(options, 'encode')(thumb, quality, options['optimize'], options['progressive'])
+            with open(thumbPath, 'wb') as f:
+                f.write(encoded)
+            info['bytes_out'] = len(encoded)
+        if widths:
+            with span('variants'):
+                metadata['variants'] = make_variants(base, name, widths, options['formats'], quality)
+        if tiled:
+            with span('tiles'):
+                metadata['tiles'] = make_tiles(base, name, quality)
+        else:
+            removeTiles(name)  # E.g. replaced by a smaller image
+        del base
+
+        try:
+            with span('placeholder'):
+                metadata['blurhash'] = make_blurhash(thumb)
+        except Exception:
+            pass  # The placeholder is optional — graceful degradation
+
+        return (name, entry['sort_key'], metadata, entry)
 
     except Exception as e:
-        return (name, {"Error": str(e)})
+        print(f"Warning: Could not process {fullPath}: {e}")
+        return (name, entry['sort_key'], {"Error": str(e)}, None)
+
+ATLAS_GUTTER = 2  # Padding around each cell so texture filtering never samples a neighbour
 
-def getMetadatas(check=False):
-    all_metadata = {}
-    if check and os.path.exists(metadataJSON):
+def build_atlas_sheet(args):
+    sheet, cells, sheetSize, cell, quality = args
+    canvas = Image.new('RGB', (sheetSize, sheetSize))
+    perRow = sheetSize // cell
+    inner = cell - 2 * ATLAS_GUTTER
+    rects = {}
+    for pos, name in cells:
         try:
-            with open(metadataJSON, 'r') as f:
-                all_metadata = json.load(f)
-        except json.JSONDecodeError:
-            print(f"Warning: Could not decode existing {metadataJSON}. Starting fresh.")
-            all_metadata = {}
+            with Image.open(f'{thumbDir}/{name}.jpg') as thumb:
+                thumb.draft('RGB', (inner, inner))
+                thumb = thumb.convert('RGB')
+            thumb.thumbnail((inner, inner), Image.LANCZOS)
+        except Exception as e:
+            print(f"Warning: Could not add {name} to atlas sheet {sheet}: {e}")
+            continue
+        x = (pos % perRow) * cell + ATLAS_GUTTER
+        y = (pos // perRow) * cell + ATLAS_GUTTER
+        canvas.paste(thumb, (x, y))
+        rects[name] = [sheet, x, y, thumb.width, thumb.height]
+    canvas.save(f'{atlasDir}/{sheet}.jpg', 'JPEG', quality=quality, optimize=True)
+    return sheet, rects
 
-    tasks = []
+def updateAtlas(staleNames, manifest, sheetSize=2048, cell=256, quality=85):
+    # Images keep their slot between builds, so only sheets whose members were added,
+    # changed or removed get re-packed
+    state = manifest.get('atlas')
+    if not state or state['params'] != [sheetSize, cell]:
+        state = {'params': [sheetSize, cell], 'slots': {}, 'rects': {}, 'versions': {}}
+    slots = state['slots']
+    perSheet = (sheetSize // cell) ** 2
+    # Images whose thumbnail failed get no slot, or their sheet would be re-packed every build
+    thumbs = set(os.listdir(thumbDir))
+    current = {name for name in imgNames if f'{name}.jpg' in thumbs}
+    dirty = {slots[name] // perSheet for name in staleNames if name in slots}
+    for name in [k for k in slots if k not in current]:
+        dirty.add(slots.pop(name) // perSheet)
+        state['rects'].pop(name, None)
+    used = set(slots.values())
+    free = (slot for slot in itertools.count() if slot not in used)
     for name in imgNames:
-        # If check is True, only process missing ones
-        if not check or name not in all_metadata or "Error" in all_metadata.get(name, {}):
-            tasks.append(name)
+        if name in current and name not in slots:
+            slots[name] = next(free)
+            dirty.add(slots[name] // perSheet)
+
+    sheetCount = max(slots.values()) // perSheet + 1 if slots else 0
+    dirty = {sheet for sheet in dirty if sheet < sheetCount}
+    dirty |= {sheet for sheet in range(sheetCount) if not os.path.exists(f'{atlasDir}/{sheet}.jpg')}
+    tasks = []
+    for sheet in sorted(dirty):
+        cells = [(slot % perSheet, name) for name, slot in slots.items() if slot // perSheet == sheet]
+        tasks.append((sheet, cells, sheetSize, cell, quality))
+        for _, name in cells:
+            state['rects'].pop(name, None)
 
     if tasks:
-        with Pool(cpu_count()) as pool:
-            results = list(tqdm(pool.imap_unordered(process_metadata, tasks), total=len(tasks), desc="Extracting Metadata"))
-        
-        for name, meta in results:
-            all_metadata[name] = meta
-    
-    all_metadata['image_order'] = imgNames
+        for sheet, rects in tqdm(getPool().imap_unordered(build_atlas_sheet, tasks), total=len(tasks), desc="Packing Atlas"):
+            state['rects'].update(rects)
+            state['versions'][str(sheet)] = format(time.time_ns(), 'x')  # Cache-busts the sheet URL
 
-    with open(metadataJSON, 'w') as metadataFile:
-        json.dump(all_metadata, metadataFile, indent=4)
+    for file in os.listdir(atlasDir):
+        stem = os.path.splitext(file)[0]
+        if not stem.isdigit() or int(stem) >= sheetCount:
+            os.remove(os.path.join(atlasDir, file))
+    state['versions'] = {k: v for k, v in state['versions'].items() if int(k) < sheetCount}
+    manifest['atlas'] = state
 
-def createSampleImages(N=25, size=(4000, 3000), quality=85):
-    q = int(max(1, min(quality, 100)))
-    if not os.path.exists(fullDir): os.mkdir(fullDir)
-    
-    for i in tqdm(range(N), desc="Creating Sample Images"):
-        sample = np.zeros(size[::-1], np.uint8)
-        cv.putText(sample, str(i), (size[0]//2, size[1]//2), cv.FONT_HERSHEY_SIMPLEX, 10, 255, 20, cv.LINE_AA)
+    writeJSON(atlasJSON, {
+        'sheet_size': sheetSize,
+        'sheets': [state['versions'].get(str(sheet), '0') for sheet in range(sheetCount)],
+        'images': state['rects'],
+    }, separators=(',', ':'))
+
+def configurePool(jobs=None, maxTasksPerChild=None):
+    global _poolSettings
+    settings = {'jobs': max(1, jobs or cpu_count()), 'maxtasksperchild': maxTasksPerChild or None}
+    if settings != _poolSettings:
+        closePool()
+        _poolSettings = settings
+
+def getPool():
+    global _pool
+    if _pool is None:
+        _pool = Pool(_poolSettings['jobs'], maxtasksperchild=_poolSettings['maxtasksperchild'])
+    return _pool
+
+def closePool(terminate=False):
+    global _pool
+    if _pool is not None:
+        if terminate:
+            _pool.terminate()
+        else:
+            _pool.close()
+        _pool.join()
+        _pool = None
+
+def physicalMemory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):  # Not available on Windows
+        return None
+
+def read_jpeg_size(f):
+    # Width and height from the SOF segment, without decoding anything
+    if f.read(2) != b'\xff\xd8':
+        return None
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        while len(marker) == 2 and marker[1] == 0xFF:  # Fill bytes
+            marker = marker[1:] + f.read(1)
+        if len(marker) < 2 or marker[1] in (0xD9, 0xDA):
+            return None
+        if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD7:
+            continue
+        segment = f.read(2)
+        if len(segment) < 2:
+            return None  # Truncated, e.g. a file still being copied
+        length = struct.unpack('>H', segment)[0]
+        if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):  # SOFn, not DHT/JPG/DAC
+            sof = f.read(5)
+            if len(sof) < 5:
+                return None
+            height, width = struct.unpack('>xHH', sof)
+            return width, height
+        f.seek(length - 2, 1)
+
+def estimateMemory(name, options):
+    # Rough peak bytes a worker needs for one image: the file itself, the RGB decode
+    # (reduced by the JPEG draft scale process_image will pick) and a couple of full copies
+    fullPath = f'{fullDir}/{name}.jpg'
+    try:
+        fileSize = os.path.getsize(fullPath)
+        with open(fullPath, 'rb') as f:
+            dims = read_jpeg_size(f)
+    except OSError:
+        return 0
+    except (struct.error, IndexError):
+        dims = None  # Damaged header: process_image reports the file
+    if not dims:
+        return fileSize * 10  # Unknown layout: assume ~10x compression
+    w, h = dims
+    scale = 1
+    if not options['widths'] and not (options['tiles'] and max(w, h) >= TILE_MIN_SIZE):  # Variants and tiles need (close to) full resolution
+        tw, th = options['size']
+        r = max(min(tw / w, th / h), min(th / w, tw / h)) * options['oversample']  # Either orientation
+        while scale * 2 <= options['draft'] and scale * 2 * r <= 1:
+            scale *= 2
+    return fileSize + 3 * 3 * math.ceil(w / scale) * math.ceil(h / scale)
+
+def prefetch_file(path, bufferSize=1 << 20):
+    # Read a file once and throw the bytes away: it is then in the OS page cache, so the
+    # worker's mmap of it doesn't block on (slow or network) storage
+    buffer = bytearray(bufferSize)
+    try:
+        with open(path, 'rb', buffering=0) as f:
+            while f.readinto(buffer):
+                pass
+    except OSError:
+        pass  # The worker reports unreadable files
+
+def prefetchAhead(names, depth):
+    # Yields names in order while I/O threads read the next `depth` files ahead of the
+    # consumer, so storage reads overlap the decoding of earlier images
+    if depth <= 0:
+        yield from names
+        return
+    io_pool = ThreadPoolExecutor(max_workers=min(8, depth))
+    try:
+        for name in names[:depth]:
+            io_pool.submit(prefetch_file, f'{fullDir}/{name}.jpg')
+        for i, name in enumerate(names):
+            if i + depth < len(names):
+                io_pool.submit(prefetch_file, f'{fullDir}/{names[i + depth]}.jpg')
+            yield name
+    finally:
+        io_pool.shutdown(wait=False, cancel_futures=True)
+
+def process_chunk(tasks):
+    # Returns the results plus, with --trace, each image's events tagged with its name
+    global _spans
+    results, events = [], []
+    for name, options in tasks:
+        _spans = [] if options['trace'] else None
+        with span('image') as info:
+            result = process_image((name, options))
+            if 'Error' in result[2]:
+                info['error'] = result[2]['Error']
+        if _spans is not None:
+            for event in _spans:
+                event['args']['image'] = name
+            events += _spans
+        results.append(result)
+    _spans = None
+    return results, events
+
+def processImages(names, options, chunksize=1, memoryBudget=None, prefetch=0, trace=None):
+    # Yields results as they complete rather than collecting them all first. Chunks are only
+    # handed to the pool while their estimated decode memory fits in memoryBudget, so a batch
+    # of huge panoramas runs a few at a time instead of all at once. Trace events from the
+    # workers are appended to `trace`.
+    if not names:
+        return
+    chunksize = max(1, chunksize)
+    stream = prefetchAhead(names, prefetch)
+    chunks = iter(lambda: list(itertools.islice(stream, chunksize)), [])
+    pool = getPool()
+    maxQueued = 2 * _poolSettings['jobs']  # Keep every worker busy without queueing everything
+    finished = queue.Queue()
+    inflight = {}
+    used = 0
+
+    def collect():
+        nonlocal used
+        index, results = finished.get()
+        used -= inflight.pop(index)
+        if isinstance(results, BaseException):
+            raise results
+        results, events = results
+        if trace is not None:
+            trace.extend(events)
+        bar.update(len(results))
+        return results
+
+    with tqdm(total=len(names), desc="Processing Images") as bar:
+        for index, chunk in enumerate(chunks):
+            need = max(estimateMemory(name, options) for name in chunk) if memoryBudget else 0
+            # A chunk larger than the whole budget still runs, just on its own
+            while inflight and (len(inflight) >= maxQueued or (memoryBudget and used + need > memoryBudget)):
+                yield from collect()
+            inflight[index] = need
+            used += need
+            pool.apply_async(process_chunk, ([(name, options) for name in chunk],),
+                             callback=lambda results, index=index: finished.put((index, results)),
+                             error_callback=lambda e, index=index: finished.put((index, e)))
+        while inflight:
+            yield from collect()
+
+def traceSummary(events, top=10):
+    # Per-stage totals and percentiles over the worker events, plus the slowest images
+    stages = {}
+    for event in events:
+        if 'image' in event['args'] and event['name'] != 'image':
+            stages.setdefault(event['name'], []).append(event['dur'] / 1000)
+    summary = {}
+    for stage, durations in stages.items():
+        durations = np.array(durations)
+        summary[stage] = {'count': len(durations), 'total_ms': round(float(durations.sum()), 1),
+                          'p50_ms': round(float(np.percentile(durations, 50)), 2), 'p99_ms': round(float(np.percentile(durations, 99)), 2)}
+    images = {}
+    for event in events:
+        image = event['args'].get('image')
+        if image is not None:
+            record = images.setdefault(image, {'image': image, 'stages': {}})
+            if event['name'] == 'image':
+                record.update({'ms': round(event['dur'] / 1000, 1), 'pid': event['pid']})
+            else:
+                record['stages'][event['name']] = round(record['stages'].get(event['name'], 0) + event['dur'] / 1000, 1)
+            for key in ('bytes_in', 'bytes_out', 'error'):
+                if key in event['args']:
+                    record[key] = event['args'][key]
+    slowest = sorted((r for r in images.values() if 'ms' in r), key=lambda r: r['ms'], reverse=True)[:top]
+    return summary, slowest
+
+def writeTrace(path, events, summary, slowest):
+    # Chrome trace-event format: load it in chrome://tracing or https://ui.perfetto.dev
+    origin = min((event['ts'] for event in events), default=0)
+    traceEvents = [dict(event, ts=round(event['ts'] - origin, 3), dur=round(event['dur'], 3)) for event in sorted(events, key=lambda e: e['ts'])]
+    for pid in sorted({event['pid'] for event in events}):
+        label = 'prepareSite' if pid == os.getpid() else f'worker {pid}'
+        traceEvents.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': label}})
+    writeJSON(path, {'traceEvents': traceEvents, 'displayTimeUnit': 'ms',
+                     'otherData': {'stages': summary, 'slowest': slowest}}, separators=(',', ':'))
+
+class MetadataStore(MutableMapping):
+    # The per-image records live in SQLite under .cache instead of a dict, so a build holds only
+    # the names and manifest entries in memory; the metadata files are streamed from it in order.
+    # Changes become durable on commit(), after the outputs are written (the journal covers a crash).
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS records (name TEXT PRIMARY KEY, meta TEXT NOT NULL)')
+
+    def __getitem__(self, name):
+        row = self.db.execute('SELECT meta FROM records WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return json.loads(row[0])
+
+    def __setitem__(self, name, meta):
+        self.db.execute('INSERT OR REPLACE INTO records VALUES (?, ?)', (name, json.dumps(meta, separators=(',', ':'))))
+
+    def __delitem__(self, name):
+        if self.db.execute('DELETE FROM records WHERE name = ?', (name,)).rowcount == 0:
+            raise KeyError(name)
+
+    def __iter__(self):
+        return iter([name for name, in self.db.execute('SELECT name FROM records')])
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def clear(self):
+        self.db.execute('DELETE FROM records')
+
+    def records(self, names):
+        # One record at a time, {} for images without one
+        return (self.get(name, {}) for name in names)
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+def loadMetadatas():
+    if not os.path.exists(metadataJSON):
+        return {}
+    try:
+        with open(metadataJSON, 'r') as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        print(f"Warning: Could not decode existing {metadataJSON}. Starting fresh.")
+        return {}
+
+def openMetadatas(manifest):
+    if not os.path.exists(cacheDir): os.mkdir(cacheDir)
+    imported = os.path.exists(recordsDB)
+    try:
+        all_metadata = MetadataStore(recordsDB)
+    except sqlite3.DatabaseError:
+        print(f"Warning: Could not read {recordsDB}. Rebuilding its images.")
+        os.remove(recordsDB)
+        all_metadata = MetadataStore(recordsDB)
+    if not manifest['images']:
+        all_metadata.clear()
+    elif not imported:
+        # Built before the store existed: take the records over from metadata.json once
+        for name, meta in loadMetadatas().items():
+            if name != 'image_order':
+                all_metadata[name] = meta
+    return all_metadata
+
+def saveMetadatas(all_metadata):
+    # Written record by record in gallery order; each entry is formatted as json.dump(indent=4)
+    # would format it inside the whole object, so the file is the same without building it in memory
+    tmpPath = f'{metadataJSON}.tmp'
+    with open(tmpPath, 'w') as f:
+        f.write('{\n')
+        for name, meta in zip(imgNames, all_metadata.records(imgNames)):
+            if meta:
+                f.write(json.dumps({name: meta}, indent=4)[2:-2] + ',\n')
+        f.write(json.dumps({'image_order': imgNames}, indent=4)[2:-2] + '\n}')
+    os.replace(tmpPath, metadataJSON)
+
+def loadIndex():
+    if not os.path.exists(indexJSON):
+        return None
+    try:
+        with open(indexJSON, 'r') as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        return None
+
+def writeShardedMetadata(all_metadata, manifest, pageSize=100, formats=(), previous=None, changed=None):
+    # The viewer loads index.json (order, dimensions, placeholders) before first paint and
+    # fetches shards/<page>.json with the full records only when an image is opened
+    # Records are read one page at a time; the index keeps only its few values per image
+    if not os.path.exists(shardDir): os.mkdir(shardDir)
+    index = {'page_size': pageSize, 'order': imgNames, 'dims': [], 'blurhash': []}
+    widths, tiles = [], []
+
+    # Pages are content-hashed in the manifest so unchanged ones are not rewritten. Given the
+    # previous index and the changed names, a page with the same images, none of them changed,
+    # is not even read again: its index values are taken over from the previous index.
+    oldDigests = manifest.get('shards', {})
+    digests = {}
+    if previous is None or changed is None or previous.get('page_size') != pageSize:
+        previous = {'order': []}
+    for page, start in enumerate(range(0, len(imgNames), pageSize)):
+        names = imgNames[start:start + pageSize]
+        shardPath = f'{shardDir}/{page}.json'
+        if names == previous['order'][start:start + pageSize] and changed.isdisjoint(names) \
+                and str(page) in oldDigests and os.path.exists(shardPath):
+            end = start + len(names)
+            index['dims'].extend(previous['dims'][start:end])
+            index['blurhash'].extend(previous['blurhash'][start:end])
+            widths.extend(previous['widths'][start:end] if 'widths' in previous else [None] * len(names))
+            tiles.extend(previous['tiles'][start:end] if 'tiles' in previous else [None] * len(names))
+            digests[str(page)] = oldDigests[str(page)]
+            continue
+        records = list(all_metadata.records(names))
+        for m in records:
+            index['dims'].append([m['Image Width'], m['Image Height']] if 'Image Width' in m else None)
+            index['blurhash'].append(m.get('blurhash'))
+            widths.append(m['variants'][formats[0]] if 'variants' in m else None)
+            tiles.append(m.get('tiles'))
+        shard = {name: {k: v for k, v in m.items() if k not in ('blurhash', 'variants', 'tiles')}
+                 for name, m in zip(names, records)}
+        text = json.dumps(shard, separators=(',', ':'))
+        digest = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+        if oldDigests.get(str(page)) != digest or not os.path.exists(shardPath):
+            writeText(shardPath, text)
+        digests[str(page)] = digest
+    for file in os.listdir(shardDir):
+        if os.path.splitext(file)[0] not in digests:
+            os.remove(os.path.join(shardDir, file))
+    manifest['shards'] = digests
+
+    if any(w is not None for w in widths):
+        index['formats'] = list(formats)
+        index['widths'] = widths
+    if any(t is not None for t in tiles):
+        index['tile_size'] = TILE_SIZE
+        index['tile_overlap'] = TILE_OVERLAP
+        index['tiles'] = tiles
+    text = json.dumps(index, separators=(',', ':'))
+    digest = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    if manifest.get('index') != digest or not os.path.exists(indexJSON):
+        writeText(indexJSON, text)
+    manifest['index'] = digest
+
+def writeColumns(all_metadata, fields):
+    # One array per field in image order: no repeated keys, and typed arrays on the client.
+    # Each column is spooled to a temp file as the records stream past, then the files are
+    # concatenated, so the table is never held in memory.
+    spools = {}
+    if fields is not None:
+        spools = {field: tempfile.TemporaryFile() for field in dict.fromkeys(list(fields) + ['Image Width', 'Image Height', 'File Size'])}
+    try:
+        for row, m in enumerate(all_metadata.records(imgNames)):
+            if fields is None:
+                for field in m:
+                    if field not in spools and field not in ('blurhash', 'variants', 'tiles', 'Error'):
+                        spools[field] = tempfile.TemporaryFile()
+                        spools[field].write(b'null,' * row)  # Absent from the records before
+            for field, spool in spools.items():
+                spool.write(json.dumps(m.get(field), separators=(',', ':')).encode() + b',')
+
+        names = sorted(spools) if fields is None else list(spools)
+        tmpPath = f'{columnsJSON}.tmp'
+        with open(tmpPath, 'wb') as f:
+            f.write(json.dumps({'order': imgNames, 'fields': names}, separators=(',', ':'))[:-1].encode() + b',"columns":{')
+            for i, field in enumerate(names):
+                spool = spools[field]
+                if spool.tell():
+                    spool.truncate(spool.tell() - 1)  # The last value's comma
+                spool.seek(0)
+                f.write((b',' if i else b'') + json.dumps(field).encode() + b':[')
+                shutil.copyfileobj(spool, f)
+                f.write(b']')
+            f.write(b'}}')
+        os.replace(tmpPath, columnsJSON)
+    finally:
+        for spool in spools.values():
+            spool.close()
+
+def writeFacetIndex(all_metadata, manifest):
+    # Filters become lookups: text fields map each value to the ascending ordinals (position in
+    # index.json's order) of its images; numbers and dates (as seconds) keep the ordinals sorted
+    # by value next to the sorted values, so a range is two binary searches.
+    # The records stream past once; only compact arrays of ordinals and values are kept.
+    texts = {field: {} for field, convert in METADATA_SCHEMA.items() if convert is _text}
+    numbers = {field: (array('q'), array('d')) for field, convert in METADATA_SCHEMA.items() if convert is not _text}
+    floats = set()  # Fields with a non-integer value; the others are written as ints
+    for i, m in enumerate(all_metadata.records(imgNames)):
+        for field, postings in texts.items():
+            value = m.get(field)
+            if isinstance(value, str) and value != '':
+                postings.setdefault(value, array('q')).append(i)
+        for field, (ordinals, values) in numbers.items():
+            value = m.get(field)
+            if METADATA_SCHEMA[field] is _timestamp:
+                if not isinstance(value, str) or value == '':
+                    continue
+                try:
+                    value = int(np.datetime64(value, 's').astype(np.int64))
+                except ValueError:
+                    continue  # --fields all keeps raw EXIF strings, which aren't ISO dates
+            elif not isinstance(value, (int, float)):
+                continue
+            if not isinstance(value, int):
+                floats.add(field)
+            ordinals.append(i)
+            values.append(value)
+
+    facets = {'values': {}, 'ranges': {}}
+    for field, postings in texts.items():
+        if postings:
+            facets['values'][field] = {value: postings[value].tolist() for value in sorted(postings)}
+    for field, (ordinals, values) in numbers.items():
+        if not values:
+            continue
+        values = np.frombuffer(values, dtype=np.float64)
+        if field not in floats:
+            values = values.astype(np.int64)
+        order = np.argsort(values, kind='stable')
+        facets['ranges'][field] = {'values': values[order].tolist(), 'images': np.frombuffer(ordinals, dtype=np.int64)[order].tolist()}
+
+    text = json.dumps(facets, separators=(',', ':'))
+    digest = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    if manifest.get('facets') != digest or not os.path.exists(facetsJSON):
+        writeText(facetsJSON, text)
+    manifest['facets'] = digest
+
+GEO_CELL = 64  # Cluster grid cell in screen pixels at each zoom (256px Web Mercator tiles)
+GEO_MAX_ZOOM = 20
+
+def geoClusters(lat, lon, zoom):
+    # Bucket points into GEO_CELL px cells of the zoom's Web Mercator grid, all at once in NumPy.
+    # Cells holding several points become clusters (centroid, size, first point); lone points
+    # are listed by their position in geo.json's points.
+    cells = 2 ** zoom * (256 // GEO_CELL)
+    x = (lon + 180) / 360
+    y = (1 - np.log(np.tan(np.radians(lat)) + 1 / np.cos(np.radians(lat))) / np.pi) / 2
+    cx = np.clip((x * cells).astype(np.int64), 0, cells - 1)
+    cy = np.clip((y * cells).astype(np.int64), 0, cells - 1)
+    _, first, inverse, counts = np.unique(cy * cells + cx, return_index=True, return_inverse=True, return_counts=True)
+    grouped = counts > 1
+    return {
+        'lat': np.round(np.bincount(inverse, lat)[grouped] / counts[grouped], 5).tolist(),
+        'lon': np.round(np.bincount(inverse, lon)[grouped] / counts[grouped], 5).tolist(),
+        'count': counts[grouped].tolist(),
+        'first': first[grouped].tolist(),
+        'points': np.sort(first[~grouped]).tolist(),
+    }
+
+def writeGeoIndex(all_metadata, manifest):
+    # geo.json: decimal coordinates of every geotagged image (by ordinal in index.json's order).
+    # geo/<zoom>.json: the clusters for one zoom level, so a map fetches only the level it shows.
+    # Past max_zoom every point stands alone and the points are drawn as they are.
+    images, lat, lon = array('q'), array('d'), array('d')
+    for i, m in enumerate(all_metadata.records(imgNames)):
+        if isinstance(m.get('GPS Latitude'), (int, float)) and isinstance(m.get('GPS Longitude'), (int, float)):
+            images.append(i)
+            lat.append(m['GPS Latitude'])
+            lon.append(m['GPS Longitude'])
+    files = {}
+    if images:
+        images, lon = np.frombuffer(images, dtype=np.int64), np.frombuffer(lon, dtype=np.float64)
+        lat = np.clip(np.frombuffer(lat, dtype=np.float64), -85.05112878, 85.05112878)  # Web Mercator's limits
+        maxZoom = 0
+        for zoom in range(GEO_MAX_ZOOM + 1):
+            clusters = geoClusters(lat, lon, zoom)
+            if not clusters['count'] and zoom > 0:
+                break  # Zoom 0 is always written, so a map has a level even for a single photo
+            files[f'{zoom}.json'] = clusters
+            maxZoom = zoom
+        files['geo.json'] = {
+            'cell': GEO_CELL,
+            'max_zoom': maxZoom,
+            'image': images.tolist(),
+            'lat': np.round(lat, 6).tolist(),
+            'lon': np.round(lon, 6).tolist(),
+        }
+
+    # Content-hashed like the shards, so unchanged levels are not rewritten
+    oldDigests = manifest.get('geo', {})
+    digests = {}
+    if files and not os.path.exists(geoDir): os.mkdir(geoDir)
+    for file, data in files.items():
+        path = geoJSON if file == 'geo.json' else f'{geoDir}/{file}'
+        text = json.dumps(data, separators=(',', ':'))
+        digest = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+        if oldDigests.get(file) != digest or not os.path.exists(path):
+            writeText(path, text)
+        digests[file] = digest
+    if os.path.exists(geoDir):
+        for file in os.listdir(geoDir):
+            if file not in digests:
+                os.remove(os.path.join(geoDir, file))
+    if not files and os.path.exists(geoJSON):
+        os.remove(geoJSON)
+    manifest['geo'] = digests
+
+SAMPLE_CAMERAS = [
+    ('Canon', 'Canon EOS R5', 'RF24-105mm F4 L IS USM'),
+    ('NIKON CORPORATION', 'NIKON Z 6_2', 'NIKKOR Z 24-70mm f/4 S'),
+    ('SONY', 'ILCE-7M4', 'FE 35mm F1.8'),
+    ('FUJIFILM', 'X-T4', 'XF16-55mmF2.8 R LM WR'),
+    ('Apple', 'iPhone 14 Pro', 'iPhone 14 Pro back triple camera 6.86mm f/1.78'),
+]
+SAMPLE_PLACES = [(48.8566, 2.3522), (40.7128, -74.0060), (35.6762, 139.6503), (-33.8688, 151.2093),
+                 (51.5074, -0.1278), (37.7749, -122.4194), (-22.9068, -43.1729), (64.1466, -21.9426)]
+SAMPLE_EPOCH = datetime(2020, 1, 1)
+
+def _to_dms(value):
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round(((value - degrees) * 60 - minutes) * 60 * 100)
+    return ((degrees, 1), (minutes, 1), (seconds, 100))
+
+def sample_exif(rng, spec, width, height, orientation):
+    make, model, lens = SAMPLE_CAMERAS[rng.integers(len(SAMPLE_CAMERAS))]
+    taken = SAMPLE_EPOCH + timedelta(seconds=int(rng.integers(max(1, spec['date_spread'] * 86400))))
+    stamp = taken.strftime('%Y:%m:%d %H:%M:%S').encode()
+    exif = {
+        '0th': {piexif.ImageIFD.Make: make.encode(), piexif.ImageIFD.Model: model.encode(),
+                piexif.ImageIFD.Orientation: orientation, piexif.ImageIFD.DateTime: stamp},
+        'Exif': {piexif.ExifIFD.DateTimeOriginal: stamp, piexif.ExifIFD.DateTimeDigitized: stamp,
+                 piexif.ExifIFD.ExposureTime: (1, int(rng.choice([30, 60, 125, 250, 500, 1000, 4000]))),
+                 piexif.ExifIFD.FNumber: (int(rng.choice([14, 18, 28, 40, 56, 80, 110])), 10),
+                 piexif.ExifIFD.ISOSpeedRatings: int(rng.choice([100, 200, 400, 800, 1600, 3200, 6400])),
+                 piexif.ExifIFD.FocalLength: (int(rng.integers(14, 201)), 1),
+                 piexif.ExifIFD.LensModel: lens.encode(),
+                 piexif.ExifIFD.PixelXDimension: width, piexif.ExifIFD.PixelYDimension: height},
+        'GPS': {},
+    }
+    if rng.random() < spec['gps']:
+        # Scattered around a few cities, like a real library, so clustering has something to do
+        lat, lon = np.array(SAMPLE_PLACES[rng.integers(len(SAMPLE_PLACES))]) + rng.normal(0, 0.05, 2)
+        exif['GPS'] = {piexif.GPSIFD.GPSLatitudeRef: b'N' if lat >= 0 else b'S', piexif.GPSIFD.GPSLatitude: _to_dms(lat),
+                       piexif.GPSIFD.GPSLongitudeRef: b'E' if lon >= 0 else b'W', piexif.GPSIFD.GPSLongitude: _to_dms(lon)}
+    return piexif.dump(exif)
+
+def make_sample(args):
+    i, spec = args
+    rng = np.random.default_rng([spec['seed'], i])  # Per image, so the corpus doesn't depend on pool order
+    q = int(max(1, min(spec['quality'], 100)))
+    huge = rng.random() < spec['huge']
+    width, height = spec['huge_size'] if huge else spec['sizes'][rng.integers(len(spec['sizes']))]
+
+    if spec['content'] == 'color':
+        # A smooth random colour field, a few shapes and sensor-like noise compress and resample
+        # like a photo rather than a flat frame
+        sample = cv.resize(rng.integers(0, 256, (6, 8, 3), dtype=np.uint8), (width, height), interpolation=cv.INTER_CUBIC)
+        for _ in range(int(rng.integers(3, 12))):
+            center = (int(rng.integers(width)), int(rng.integers(height)))
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            cv.circle(sample, center, int(rng.integers(min(width, height) // 20, min(width, height) // 3)), color, -1, cv.LINE_AA)
+        noise = np.empty_like(sample)
+        cv.setRNGSeed(int(rng.integers(2**31)))
+        cv.randn(noise, 128, 12)
+        sample = cv.addWeighted(sample, 1.0, noise, 1.0, -128)
+        cv.putText(sample, str(i), (width // 3, height // 2), cv.FONT_HERSHEY_SIMPLEX, min(width, height) / 300, (255, 255, 255), max(2, min(width, height) // 150), cv.LINE_AA)
+    else:
+        sample = np.zeros((height, width), np.uint8)
+        cv.putText(sample, str(i), (width//2, height//2), cv.FONT_HERSHEY_SIMPLEX, 10, 255, 20, cv.LINE_AA)
         sample = cv.copyMakeBorder(sample, 100, 100, 100, 100, cv.BORDER_CONSTANT, None, value=255)
         sample = cv.copyMakeBorder(sample, 75, 75, 75, 75, cv.BORDER_CONSTANT, None, value=0)
-        cv.imwrite(f'{fullDir}/{i}.jpg', sample, [cv.IMWRITE_JPEG_QUALITY, q, cv.IMWRITE_JPEG_PROGRESSIVE, 1])
+    _, data = cv.imencode('.jpg', sample, [cv.IMWRITE_JPEG_QUALITY, q, cv.IMWRITE_JPEG_PROGRESSIVE, 1])
+    data = data.tobytes()
 
-if __name__ == '__main__':
+    if spec['exif']:
+        orientation = int(rng.choice([3, 6, 8])) if rng.random() < spec['rotated'] else 1
+        out = io.BytesIO()
+        piexif.insert(sample_exif(rng, spec, sample.shape[1], sample.shape[0], orientation), data, out)
+        data = out.getvalue()
+    if rng.random() < spec['corrupt']:
+        if rng.random() < 0.5:
+            data = data[:int(len(data) * rng.uniform(0.2, 0.8))]  # Truncated, e.g. an interrupted copy
+        else:
+            start = int(len(data) * rng.uniform(0.3, 0.7))
+            data = data[:start] + bytes(min(4096, len(data) - start)) + data[start + 4096:]  # Zeroed block
+    with open(f'{fullDir}/{i}.jpg', 'wb') as f:
+        f.write(data)
+
+def createSampleImages(N=25, size=(4000, 3000), quality=85, sizes=None, content='gray', exif=False, seed=0,
+                       rotated=0.0, dateSpread=730, gps=0.0, corrupt=0.0, huge=0.0, hugeSize=(12000, 8000)):
+    # Generated in parallel and reproducibly (one RNG stream per image). With exif=True each image
+    # gets a camera, lens, exposure, DateTimeOriginal within dateSpread days, an orientation tag
+    # for `rotated` of them and GPS for `gps` of them; `corrupt` and `huge` are fractions of
+    # damaged files and hugeSize panoramas.
+    if not os.path.exists(fullDir): os.mkdir(fullDir)
+    spec = {'sizes': [tuple(s) for s in (sizes or [size])], 'quality': quality, 'content': content, 'exif': exif,
+            'seed': seed, 'rotated': rotated, 'date_spread': dateSpread, 'gps': gps, 'corrupt': corrupt,
+            'huge': huge, 'huge_size': tuple(hugeSize)}
+    tasks = [(i, spec) for i in range(N)]
+    for _ in tqdm(getPool().imap_unordered(make_sample, tasks, chunksize=max(1, min(16, N // (4 * _poolSettings['jobs'])))), total=N, desc="Creating Sample Images"):
+        pass
+
+def buildParser():
     parser = argparse.ArgumentParser(description='Prepare site images and metadata.')
     parser.add_argument('-n', '--number', type=int, default=25, help='Number of sample images.')
     parser.add_argument('-q', '--quality', type=int, default=85, help='Quality (1-100).')
-    args = parser.parse_args()
+    parser.add_argument('-f', '--force', action='store_true', help='Ignore the build manifest and rebuild every image.')
+    parser.add_argument('--hash', action='store_true', help='Also compare content hashes, so touched but unchanged files are not rebuilt.')
+    parser.add_argument('--draft', choices=['off', '2', '4', '8', 'auto'], default='auto', help='Largest JPEG scaled-decode factor for thumbnails (auto = 8, limited by --draft-oversample).')
+    parser.add_argument('--draft-oversample', type=float, default=2.0, help='Decode at least this many times the thumbnail size before resampling (default: 2).')
+    parser.add_argument('--engine', choices=['auto', 'pil', 'cv'], default='auto', help='Library that decodes, resizes and encodes the thumbnails; auto benchmarks both per stage on a few images and keeps the fastest (default: auto).')
+    parser.add_argument('--min-psnr', type=float, default=35.0, help='With --engine auto, only pick backends whose output is within this PSNR (dB) of Pillow\'s (default: 35).')
+    parser.add_argument('--filter', choices=list(RESIZE_FILTERS), default='lanczos', help='Thumbnail resampling filter; area is faster and fine for large reductions (default: lanczos).')
+    parser.add_argument('--optimize', action=argparse.BooleanOptionalAction, default=True, help='Optimize the thumbnail JPEG Huffman tables: a few percent smaller, noticeably slower (default: on).')
+    parser.add_argument('--progressive', action=argparse.BooleanOptionalAction, default=True, help='Encode progressive thumbnail JPEGs (default: on).')
+    parser.add_argument('--widths', type=lambda v: sorted({int(w) for w in v.split(',') if w}), default=[], help='Comma separated responsive widths to generate under sizes/, e.g. 320,640,1280,2560.')
+    parser.add_argument('--formats', type=lambda v: [f.strip().lower().replace('jpeg', 'jpg') for f in v.split(',') if f.strip()], default=['webp', 'jpg'], help='Formats for the responsive widths, best first (avif, webp, jpg). Default: webp,jpg.')
+    parser.add_argument('--fields', type=lambda v: None if v == 'all' else [f.strip() for f in v.split(',') if f.strip()], default=DEFAULT_FIELDS, help="Comma separated exifread tags to keep (default: the typed schema), or 'all' for every tag as a string.")
+    parser.add_argument('--legacy-metadata', action='store_true', help='Also write metadata/metadata.json, every record in one file, for tools that still read it (the viewer uses index.json and the shards).')
+    parser.add_argument('--columnar', action='store_true', help='Also write metadata/columns.json, the whole table as one array per field.')
+    parser.add_argument('--tiles', action='store_true', help=f'Generate Deep Zoom tile pyramids under tiles/ for images of {TILE_MIN_SIZE}px and up, so zooming loads only the visible tiles.')
+    parser.add_argument('--atlas', action='store_true', help='Pack small thumbnails into atlas/ sheets for the 3D view.')
+    parser.add_argument('--atlas-size', type=int, default=2048, help='Atlas sheet width and height in pixels (default: 2048).')
+    parser.add_argument('--atlas-cell', type=int, default=256, help='Atlas cell size in pixels (default: 256).')
+    parser.add_argument('--page-size', type=int, default=100, help='Images per metadata detail shard (default: 100).')
+    parser.add_argument('-j', '--jobs', type=int, default=cpu_count(), help=f'Worker processes shared by every stage (default: {cpu_count()}).')
+    parser.add_argument('--chunksize', type=int, default=1, help='Images handed to a worker at a time; raise it for many small files (default: 1).')
+    parser.add_argument('--max-tasks-per-child', type=int, default=100, help='Replace a worker after this many tasks to release fragmented memory, 0 = never (default: 100).')
+    parser.add_argument('--memory-budget', type=int, default=None, help='MB of decode memory the workers may use at once, estimated from each JPEG header; 0 = unlimited (default: half the RAM).')
+    parser.add_argument('--prefetch', type=int, default=8, help='Images read ahead into the page cache on I/O threads while others decode, 0 = off (default: 8).')
+    parser.add_argument('--checkpoint-every', type=int, default=100, help='Sync the results journal to disk every N images, the most an interrupted build redoes (default: 100).')
+    parser.add_argument('--trace', type=str, default=None, help='Record per-image timings of every stage (read, EXIF, decode, resize, encode, ...) and write them to this file as a Chrome trace.')
+    parser.add_argument('--trace-top', type=int, default=10, help='With --trace, list this many of the slowest images (default: 10).')
+    parser.add_argument('--watch', action='store_true', help='Keep running and rebuild whenever images in fulls/ are added, changed, renamed or deleted.')
+    parser.add_argument('--poll', action='store_true', help='With --watch, poll fulls/ instead of using filesystem events (watchdog).')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between checks for changes in --watch mode (default: 1).')
+    parser.add_argument('--debounce', type=float, default=2.0, help='Seconds fulls/ must stay unchanged before a --watch rebuild, so imports are built in one go (default: 2).')
+    return parser
+
+def buildOptions(args, parser):
+    # Per-image settings shared with the pool workers
+    formats = []
+    for fmt in args.formats:
+        if fmt not in VARIANT_FORMATS:
+            parser.error(f'Unknown format: {fmt}')
+        if fmt != 'jpg' and not features.check(fmt):
+            print(f'Warning: This Pillow build cannot encode {fmt}, skipping it.')
+            continue
+        formats.append(fmt)
+    if 'jpg' not in formats:
+        formats.append('jpg')  # Always keep a universally decodable fallback
+
+    return {
+        'quality': args.quality,
+        'size': (1200, 900),
+        'draft': {'off': 1, 'auto': 8}.get(args.draft) or int(args.draft),
+        'oversample': max(1.0, args.draft_oversample),
+        'hash': args.hash,
+        'widths': args.widths,
+        'tiles': args.tiles,
+        'formats': formats,
+        'fields': args.fields,
+        'engine': {stage: args.engine for stage in ENGINE_STAGES},  # 'auto' is resolved by chooseEngine
+        'filter': args.filter,
+        'optimize': args.optimize,
+        'progressive': args.progressive,
+        'trace': bool(args.trace),
+    }
 
+def recordResult(result, manifest, all_metadata, sort_keys):
+    name, sort_key, meta, entry = result
+    all_metadata[name] = meta
+    if sort_key is not None:
+        sort_keys[name] = sort_key
+    # Only record images whose outputs were all produced, so failures retry next build
+    if entry:
+        manifest['images'][name] = entry
+    else:
+        manifest['images'].pop(name, None)
+
+def changedFields(previous, all_metadata, names):
+    # The record fields that differ after reprocessing, to tell which aggregates the changes reach
+    fields = set()
+    for name, meta in zip(names, all_metadata.records(names)):
+        old = previous.get(name, {})
+        fields.update(field for field in old.keys() | meta.keys() if old.get(field) != meta.get(field))
+    return fields
+
+def build(args, options, createSamples=True, changes=None):
+    global _spans
     # Setup Stats
     stats = {}
     start_time = time.time()
+    _spans = [] if args.trace else None  # The build's own phases; workers' events are added below
+    trace = _spans
+    formats = options['formats']
+    imgNames.clear()
+    configurePool(args.jobs, args.max_tasks_per_child)
+    memoryBudget = (physicalMemory() or 0) // 2 if args.memory_budget is None else args.memory_budget * 2**20
 
     # Ensure directories exist
-    for d in [fullDir, thumbDir, metadataDir]:
+    for d in [fullDir, thumbDir, metadataDir] + ([variantDir] if args.widths else []) + ([atlasDir] if args.atlas else []) + ([tileDir] if args.tiles else []):
         if not os.path.exists(d): os.mkdir(d)
 
     # Check for empty fulls
-    if len(os.listdir(fullDir)) == 0:
+    if createSamples and len(os.listdir(fullDir)) == 0:
         print(f'No images found. Creating {args.number} sample images...')
         createSampleImages(N=args.number, quality=args.quality)
 
     print('Processing existing images...')
 
-    # 1. CLEANUP & SORTING
-    # This part is fast enough to stay single-threaded usually
-    processable_files = []
+    # 1. CLEANUP
     for file in os.listdir(fullDir):
         name, ext = os.path.splitext(file)
         ext = ext.lower()
@@ -202,45 +1517,195 @@ if __name__ == '__main__':
                 if file != new_file: 
                     os.rename(os.path.join(fullDir, file), os.path.join(fullDir, new_file))
                 file = new_file
-            processable_files.append(file)
-            
-    # Sort by Date Taken
-    image_files_for_sorting = []
-    for file in processable_files:
-        name_without_ext = os.path.splitext(file)[0]
-        full_path = os.path.join(fullDir, file)
-        exif_date_time = None
-        try:
-            with open(full_path, 'rb') as f:
-                tags = exifread.process_file(f, stop_tag='DateTimeOriginal')
-                if 'EXIF DateTimeOriginal' in tags:
-                    try:
-                        exif_date_time = datetime.strptime(str(tags['EXIF DateTimeOriginal']), "%Y:%m:%d %H:%M:%S")
-                    except ValueError: pass
-        except: pass
-        
-        sort_key = exif_date_time.timestamp() if exif_date_time else os.path.getmtime(full_path)
-        image_files_for_sorting.append((name_without_ext, sort_key))
-
-    image_files_for_sorting.sort(key=lambda x: x[1])
-    imgNames = [name for name, _ in image_files_for_sorting]
-    
-    # 2. THUMBNAILS
+            imgNames.append(os.path.splitext(file)[0])
+
+    # Work out which images changed since the last build
+    params = {'quality': args.quality, 'thumb_size': list(options['size']), 'draft': options['draft'], 'oversample': options['oversample'],
+              'widths': args.widths, 'formats': formats, 'fields': args.fields, 'tiles': args.tiles,
+              'engine': args.engine, 'filter': args.filter, 'optimize': args.optimize, 'progressive': args.progressive}
+    with span('check manifest'):
+        manifest = loadManifest(params)
+        if args.force:
+            manifest['images'] = {}
+            if os.path.exists(journalPath): os.remove(journalPath)
+        all_metadata = openMetadatas(manifest)
+        resumed = replayJournal(manifest, all_metadata, params)
+        if resumed:
+            print(f'Resuming an interrupted build: {len(resumed)} images already processed.')
+        staleNames = getStaleImages(manifest, all_metadata, useHash=args.hash, widths=args.widths, names=changes)
+        pruned = pruneDeleted(manifest, all_metadata, widths=args.widths, formats=formats)
+    print(f'{len(staleNames)} new or changed, {len(imgNames) - len(staleNames)} unchanged, {pruned} removed.')
+
+    # 2. THUMBNAILS, METADATA & PLACEHOLDERS (single pass per image)
     t0 = time.time()
-    print('Generating thumbnails...')
-    getThumbs(quality=args.quality, check=False)
-    stats['thumbs_time'] = time.time() - t0
+    if args.engine == 'auto' and staleNames:
+        with span('choose engine'):
+            options = dict(options, engine=chooseEngine(staleNames, options, args.min_psnr))
+    sort_keys = {name: manifest['images'][name]['sort_key'] for name in imgNames if name in manifest['images']}
+    previousRecords = dict(zip(staleNames, all_metadata.records(staleNames)))
+    journal = openJournal(params)
+    try:
+        with span('process images', images=len(staleNames)):
+            for done, result in enumerate(processImages(staleNames, options, args.chunksize, memoryBudget, args.prefetch, trace), 1):
+                journal.write(json.dumps(result, separators=(',', ':')) + '\n')
+                journal.flush()
+                if done % max(1, args.checkpoint_every) == 0:
+                    os.fsync(journal.fileno())  # Checkpoint: everything so far survives a crash
+                recordResult(result, manifest, all_metadata, sort_keys)
+    finally:
+        journal.close()
+    stats['process_time'] = time.time() - t0
+
+    # 3. SORT BY DATE TAKEN & WRITE
+    # Anything without a key from the manifest or this run (e.g. unreadable files) gets a header-only scan
+    with span('sort'):
+        sort_keys.update(scanSortKeys([name for name in imgNames if name not in sort_keys]))
+        imgNames.sort(key=lambda name: sort_keys[name])
+    # Only the outputs the changes reach are regenerated: the shard pages holding changed images,
+    # and the aggregates keyed by position in the order when the order or one of their fields changed
+    with span('write metadata'):
+        previousIndex = loadIndex()
+        reordered = bool(resumed) or previousIndex is None or previousIndex.get('order') != imgNames
+        fields = changedFields(previousRecords, all_metadata, staleNames)
+        if args.legacy_metadata:
+            if reordered or fields or not os.path.exists(metadataJSON):
+                saveMetadatas(all_metadata)
+        elif os.path.exists(metadataJSON):
+            os.remove(metadataJSON)
+        writeShardedMetadata(all_metadata, manifest, pageSize=max(1, args.page_size), formats=formats,
+                             previous=previousIndex, changed=set(staleNames) | set(resumed))
+        if args.columnar:
+            columnFields = fields if args.fields is None else fields & set(args.fields + ['Image Width', 'Image Height', 'File Size'])
+            if reordered or columnFields or not os.path.exists(columnsJSON):
+                writeColumns(all_metadata, args.fields)
+        elif os.path.exists(columnsJSON):
+            os.remove(columnsJSON)
+        if reordered or fields & set(GPS_FIELDS) or 'geo' not in manifest:
+            writeGeoIndex(all_metadata, manifest)
+        if reordered or fields & set(METADATA_SCHEMA) or 'facets' not in manifest or not os.path.exists(facetsJSON):
+            writeFacetIndex(all_metadata, manifest)
+
+    if not args.tiles and os.path.exists(tileDir):
+        shutil.rmtree(tileDir)
 
-    # 3. METADATA
-    t1 = time.time()
-    print('Extracting metadata...')
-    getMetadatas(check=False)
-    stats['metadata_time'] = time.time() - t1
+    # 4. ATLAS (packed from the thumbnails)
+    if args.atlas:
+        with span('atlas'):
+            updateAtlas(staleNames + resumed, manifest, sheetSize=args.atlas_size, cell=min(args.atlas_cell, args.atlas_size), quality=args.quality)
+    elif 'atlas' in manifest or os.path.exists(atlasJSON):
+        manifest.pop('atlas', None)
+        if os.path.exists(atlasJSON): os.remove(atlasJSON)
+        shutil.rmtree(atlasDir, ignore_errors=True)
+    all_metadata.commit()
+    all_metadata.close()
+    saveManifest(manifest)
+    os.remove(journalPath)  # Everything is in the manifest and metadata now
+    if not args.watch:
+        closePool()
 
     stats['total_time'] = time.time() - start_time
+    _spans = None
 
     print('\n=== Processing Complete ===')
-    print(f"Total Time:    {stats['total_time']:.2f}s")
-    print(f"Thumbs Time:   {stats['thumbs_time']:.2f}s")
-    print(f"Metadata Time: {stats['metadata_time']:.2f}s")
+    print(f"Total Time:      {stats['total_time']:.2f}s")
+    print(f"Processing Time: {stats['process_time']:.2f}s")
+    if trace is not None:
+        stats['stages'], stats['slowest'] = traceSummary(trace, args.trace_top)
+        writeTrace(args.trace, trace, stats['stages'], stats['slowest'])
+        print(f"\n{'stage':<12} {'images':>7} {'total s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+        for stage, row in stats['stages'].items():
+            print(f"{stage:<12} {row['count']:>7} {row['total_ms'] / 1000:>9.2f} {row['p50_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+        if stats['slowest']:
+            print(f"\nSlowest {len(stats['slowest'])} images:")
+            for record in stats['slowest']:
+                breakdown = ', '.join(f'{stage} {ms:.0f}' for stage, ms in sorted(record['stages'].items(), key=lambda item: -item[1]))
+                print(f"  {record['ms']:>8.0f} ms  {record['image']}  ({breakdown})" + (f"  ERROR: {record['error']}" if 'error' in record else ''))
+        print(f'Trace written to {args.trace}')
+    return stats
 
+def snapshotImages():
+    snapshot = {}
+    with os.scandir(fullDir) as entries:
+        for entry in entries:
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in ('.jpg', '.jpeg'):
+                st = entry.stat()
+                snapshot[entry.name] = (st.st_size, st.st_mtime_ns)
+    return snapshot
+
+def describeChanges(old, new):
+    added = [f for f in new if f not in old]
+    removed = [f for f in old if f not in new]
+    changed = [f for f in new if f in old and new[f] != old[f]]
+    return f'{len(added)} added, {len(changed)} changed, {len(removed)} removed'
+
+def changedNames(old, new):
+    # Images added, changed or removed between two snapshots
+    return {os.path.splitext(f)[0] for f in old.keys() | new.keys() if old.get(f) != new.get(f)}
+
+def watch(args, options):
+    # Rebuild on changes to fulls/. Each rebuild checks only the files that changed, processes
+    # them on the shared pool (kept alive) and regenerates only the outputs they reach
+    events = None
+    observer = None
+    try:
+        build(args, options)
+        snapshot = snapshotImages()
+
+        if Observer is not None and not args.poll:
+            events = threading.Event()
+            handler = FileSystemEventHandler()
+            handler.on_any_event = lambda event: events.set()
+            observer = Observer()
+            observer.schedule(handler, fullDir)
+            observer.start()
+            print(f'\nWatching {fullDir} for changes (Ctrl+C to stop)...')
+        else:
+            print(f'\nPolling {fullDir} every {args.poll_interval}s for changes (Ctrl+C to stop)...')
+
+        pending = False
+        failed = False
+        lastChange = 0
+        current = snapshot
+        while True:
+            time.sleep(args.poll_interval)
+            # With events the directory is only listed once something happened
+            if events is None or events.is_set():
+                if events is not None:
+                    events.clear()
+                latest = snapshotImages()
+                if latest != current:
+                    # Keep waiting while files are still being copied in or written
+                    current = latest
+                    pending = True
+                    lastChange = time.monotonic()
+            if not pending or time.monotonic() - lastChange < args.debounce:
+                continue
+
+            pending = False
+            print(f"\n[{datetime.now():%H:%M:%S}] {describeChanges(snapshot, current)}, rebuilding...")
+            changes = None if failed else changedNames(snapshot, current)
+            try:
+                build(args, options, createSamples=False, changes=changes)
+                failed = False
+            except Exception as e:
+                print(f'Build failed: {e}')
+                failed = True  # Check every image next time, not just the later changes
+            # Renames done by the build itself (.JPG -> .jpg) are not new changes
+            snapshot = current = snapshotImages()
+            if events is not None:
+                events.clear()
+    except KeyboardInterrupt:
+        print('\nStopped watching.')
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+        closePool(terminate=True)
+
+if __name__ == '__main__':
+    parser = buildParser()
+    args = parser.parse_args()
+    if args.watch:
+        watch(args, buildOptions(args, parser))
+    else:
+        build(args, buildOptions(args, parser))